@@ -0,0 +1,231 @@
+"""
+Non-interactive entry point for cron and other schedulers.
+
+    python batch.py update --all --workers 8 --deadline 3000
+    python batch.py add 12345 67890
+    python batch.py export --all
+    python batch.py rebuild --all
+
+Progress goes to stdout as one JSON object per line.  Exit codes:
+0 everything worked, 1 some drivers failed, 2 bad arguments,
+3 the deadline passed before every driver was started.
+"""
+
+import argparse
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from classes.driver import Driver, PICKLE_DIR, add_drivers, UPDATE_WORKERS, REBUILD_WORKERS, load_summaries, rebuild_drivers
+from classes.printing import quiet_thread
+from classes.scheduler import scheduler, REQUESTS_PER_SECOND, BURST
+from classes.storage import saved_driver_ids
+
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_USAGE = 2
+EXIT_DEADLINE = 3
+
+# Progress lines go here, past the wrapper that silences the
+# drivers' own printing
+log_stream = sys.stdout
+
+
+def log(event: str, **fields):
+    fields = {'time': round(time.time(), 3), 'event': event, **fields}
+    log_stream.write(json.dumps(fields, default=str) + '\n')
+    log_stream.flush()
+
+
+def parse_args(argv: list):
+    parser = argparse.ArgumentParser(prog='batch.py', description='Update LFM driver data without the prompt')
+    parser.add_argument('--rate', type=float, default=REQUESTS_PER_SECOND, help='API requests per second, shared by every worker')
+    parser.add_argument('--burst', type=int, default=BURST, help='requests allowed back to back')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    update = commands.add_parser('update', help='fetch new sessions for saved drivers')
+    add_selection(update)
+    update.add_argument('--force', action='store_true', help='throw away saved sessions and fetch everything again')
+    update.add_argument('--workers', type=int, default=UPDATE_WORKERS)
+    update.add_argument('--deadline', type=float, help="seconds from now after which drivers that haven't started are skipped")
+
+    add = commands.add_parser('add', help='start tracking drivers')
+    add.add_argument('ids', type=int, nargs='+')
+    add.add_argument('--workers', type=int, default=UPDATE_WORKERS)
+
+    export = commands.add_parser('export', help="write drivers' JSON files")
+    add_selection(export)
+
+    rebuild = commands.add_parser('rebuild', help='analyze saved drivers again from the caches, without the API')
+    add_selection(rebuild)
+    rebuild.add_argument('--workers', type=int, default=REBUILD_WORKERS)
+
+    return parser.parse_args(argv)
+
+
+def add_selection(parser):
+    parser.add_argument('ids', type=int, nargs='*', help='driver ids')
+    parser.add_argument('--all', action='store_true', help='every saved driver')
+
+
+def selected_ids(args):
+    """
+    Driver ids the command works on, None if none were given
+    """
+
+    if args.all:
+        return saved_driver_ids(PICKLE_DIR)
+    if args.ids:
+        return args.ids
+
+    return None
+
+
+def update_all(driver_ids: list, summaries: dict, workers: int, force: bool = False, deadline: float = None):
+    """
+    Update drivers in parallel.  Every request goes through the
+    shared scheduler, so workers only change how many drivers wait
+    on it at once.  Returns the exit code.
+    """
+
+    def update(driver_id):
+        quiet_thread()
+        if deadline is not None and time.monotonic() > deadline:
+            return None
+
+        started = time.monotonic()
+        driver = Driver(driver_id, summaries.get(driver_id))
+        before = driver.races
+        if force:
+            driver.force_update()
+        else:
+            driver.gather_sessions()
+
+        return {
+            'name': driver.name,
+            'added': driver.races - (0 if force else before),
+            'races': driver.races,
+            'seconds': round(time.monotonic() - started, 3),
+        }
+
+    failed = 0
+    skipped = 0
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = {pool.submit(update, driver_id): driver_id for driver_id in driver_ids}
+        for future in as_completed(futures):
+            driver_id = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                failed += 1
+                log('driver_failed', driver=driver_id, error=f'{type(e).__name__}: {e}')
+                continue
+
+            if result is None:
+                skipped += 1
+                log('driver_skipped', driver=driver_id, reason='deadline')
+            else:
+                log('driver_updated', driver=driver_id, **result)
+
+    log('finished', drivers=len(driver_ids), failed=failed, skipped=skipped)
+    if failed:
+        return EXIT_FAILED
+    if skipped:
+        return EXIT_DEADLINE
+
+    return EXIT_OK
+
+
+def add_all(driver_ids: list, workers: int):
+    """
+    Onboard new drivers together with add_drivers,
+    so sessions they share are downloaded once
+    """
+
+    started = time.monotonic()
+    failed = 0
+    for driver_id, driver, error in add_drivers(driver_ids, workers):
+        if error:
+            failed += 1
+            log('driver_failed', driver=driver_id, error=f'{type(error).__name__}: {error}')
+        else:
+            log('driver_added', driver=driver_id, name=driver.name, races=driver.races)
+
+    log('finished', drivers=len(driver_ids), failed=failed, seconds=round(time.monotonic() - started, 3))
+    return EXIT_FAILED if failed else EXIT_OK
+
+
+def export_all(driver_ids: list, summaries: dict):
+    failed = 0
+    for driver_id in driver_ids:
+        try:
+            driver = Driver(driver_id, summaries.get(driver_id))
+            driver.json()
+        except Exception as e:
+            failed += 1
+            log('driver_failed', driver=driver_id, error=f'{type(e).__name__}: {e}')
+            continue
+
+        log('driver_exported', driver=driver_id, name=driver.name, file=driver.json_file)
+
+    log('finished', drivers=len(driver_ids), failed=failed)
+    return EXIT_FAILED if failed else EXIT_OK
+
+
+def rebuild_all(driver_ids: list, summaries: dict, workers: int):
+    failures = dict(rebuild_drivers({driver_id: summaries.get(driver_id) for driver_id in driver_ids}, workers))
+    for driver_id in driver_ids:
+        if driver_id in failures:
+            log('driver_failed', driver=driver_id, error=failures[driver_id])
+        else:
+            log('driver_rebuilt', driver=driver_id)
+
+    log('finished', drivers=len(driver_ids), failed=len(failures))
+    return EXIT_FAILED if failures else EXIT_OK
+
+
+def run(argv: list):
+    """
+    Run one batch command.  Returns the exit code.
+    """
+
+    try:
+        args = parse_args(argv)
+    except SystemExit as e:
+        # --help exits 0, bad arguments exit 2
+        return e.code
+
+    scheduler.set_rate(args.rate, args.burst)
+    quiet_thread()
+
+    summaries = load_summaries()
+    saved = set(saved_driver_ids(PICKLE_DIR))
+    if args.command == 'add':
+        driver_ids = [driver_id for driver_id in dict.fromkeys(args.ids) if driver_id not in saved]
+    else:
+        driver_ids = selected_ids(args)
+        if driver_ids is None:
+            log('error', error='give driver ids or --all')
+            return EXIT_USAGE
+
+        # Building a Driver saves it, so never build one for an unknown id
+        unknown = [driver_id for driver_id in driver_ids if driver_id not in saved]
+        if unknown:
+            log('error', error='not saved drivers (use add)', drivers=unknown)
+            return EXIT_USAGE
+
+    log('started', command=args.command, drivers=len(driver_ids))
+    if args.command == 'update':
+        deadline = time.monotonic() + args.deadline if args.deadline is not None else None
+        return update_all(driver_ids, summaries, args.workers, args.force, deadline)
+    if args.command == 'add':
+        return add_all(driver_ids, args.workers)
+    if args.command == 'export':
+        return export_all(driver_ids, summaries)
+
+    return rebuild_all(driver_ids, summaries, args.workers)
+
+
+if __name__ == '__main__':
+    sys.exit(run(sys.argv[1:]))
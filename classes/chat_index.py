@@ -0,0 +1,132 @@
+import re
+import threading
+from bisect import bisect_left
+
+from classes.session import session_store
+from classes.shared_index import shared_index
+
+TOKEN_PATTERN = re.compile(r'\w+')
+
+
+def tokenize(text: str):
+    return TOKEN_PATTERN.findall(str(text).lower())
+
+
+class ChatIndex:
+    """
+    Inverted index over the chat of every tracked session.
+    Each message is indexed under the words of its user name,
+    the words of the message and the session id.
+    Built the first time it's searched, then kept up to date
+    as sessions are added.
+    """
+
+    messages: dict      # chat id -> {'session_id', 'name', 'message'}
+    postings: dict      # token -> set of chat ids
+    sessions: set       # session ids already indexed
+
+    def __init__(self):
+        self.messages = {}
+        self.postings = {}
+        self.sessions = set()
+        self.vocabulary = []
+        self.vocabulary_dirty = False
+        self.built = False
+        self.lock = threading.RLock()
+
+    def build(self):
+        """
+        Index every session a tracked driver has been in
+        """
+
+        with self.lock:
+            for session_id in shared_index.session_ids():
+                if session_id not in self.sessions:
+                    self.add_session(session_id, session_store.get(session_id).chat)
+            self.built = True
+
+    def session_added(self, race):
+        """
+        Called when a driver picks up a session.  Nothing to do
+        until the index has been built.
+        """
+
+        with self.lock:
+            if self.built and race.session_id not in self.sessions:
+                self.add_session(race.session_id, race.chat)
+
+    def add_session(self, session_id: int, chat: list):
+        with self.lock:
+            self.sessions.add(session_id)
+            for chats in chat or []:
+                if type(chats) == dict:
+                    chats = [chats]
+                for message in chats:
+                    self.add_message(session_id, message)
+
+    def add_message(self, session_id: int, message: dict):
+        chat_id = message['id']
+        if chat_id in self.messages:
+            return
+
+        self.messages[chat_id] = {
+            'session_id': session_id,
+            'name': message['name'],
+            'message': message['message'],
+        }
+
+        tokens = set(tokenize(message['name']))
+        tokens.update(tokenize(message['message']))
+        tokens.add(str(session_id))
+        for token in tokens:
+            if token not in self.postings:
+                self.postings[token] = set()
+                self.vocabulary_dirty = True
+            self.postings[token].add(chat_id)
+
+    def matching(self, term: str):
+        """
+        Chat ids with a token that starts with term
+        """
+
+        if self.vocabulary_dirty:
+            self.vocabulary = sorted(self.postings)
+            self.vocabulary_dirty = False
+
+        found = set()
+        position = bisect_left(self.vocabulary, term)
+        while position < len(self.vocabulary) and self.vocabulary[position].startswith(term):
+            found |= self.postings[self.vocabulary[position]]
+            position += 1
+
+        return found
+
+    def search(self, search_terms: str):
+        """
+        Messages matching every term, newest first
+        """
+
+        with self.lock:
+            if not self.built:
+                self.build()
+
+            terms = tokenize(search_terms)
+            if len(terms) == 0:
+                chat_ids = set(self.messages)
+            else:
+                # Rarest term first keeps the intersections small
+                candidates = sorted((self.matching(term) for term in terms), key=len)
+                chat_ids = set(candidates[0])
+                for candidate in candidates[1:]:
+                    chat_ids &= candidate
+                    if not chat_ids:
+                        break
+
+            tracked = shared_index.session_ids()
+            return [
+                self.messages[chat_id] for chat_id in sorted(chat_ids, reverse=True)
+                if self.messages[chat_id]['session_id'] in tracked
+            ]
+
+
+chat_index = ChatIndex()
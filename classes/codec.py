@@ -0,0 +1,468 @@
+import json
+import struct
+from array import array
+
+from classes.lap import Lap
+from classes.lap_table import LapTable
+from classes.laptime import LapTime
+from classes.race import Race
+from classes.sector import Sector
+from classes.track_stats import TrackStats
+
+# Every file starts with MAGIC and the schema version it was written with.
+# Older versions are decoded with their own decoder and then upgraded
+# one step at a time through the MIGRATIONS tables below.
+MAGIC = b'LFMD'
+SCHEMA_VERSION = 2
+
+FILE_HEADER = struct.Struct('<4sH')
+LENGTH = struct.Struct('<I')
+INT = struct.Struct('<q')
+FLOAT = struct.Struct('<d')
+
+NO_TIME = -1
+
+
+class Writer:
+    """
+    Builds a record out of typed fields
+    """
+
+    def __init__(self):
+        self.parts = []
+
+    def int(self, value: int):
+        self.parts.append(INT.pack(int(value)))
+
+    def float(self, value: float):
+        self.parts.append(FLOAT.pack(float(value)))
+
+    def bool(self, value: bool):
+        self.parts.append(b'\x01' if value else b'\x00')
+
+    def bytes(self, value: bytes):
+        self.parts.append(LENGTH.pack(len(value)))
+        self.parts.append(value)
+
+    def string(self, value: str):
+        self.bytes(value.encode('utf-8'))
+
+    def value(self, value):
+        """
+        Anything JSON can hold.  Used for API values whose type varies.
+        """
+        self.string(json.dumps(value))
+
+    def time(self, value):
+        self.int(NO_TIME if value is None else LapTime.parse(value).ms)
+
+    def optional_int(self, value):
+        self.int(NO_TIME if value is None else value)
+
+    def ints(self, values):
+        if type(values) != array:
+            values = array('i', values)
+        self.bytes(values.tobytes())
+
+    def output(self):
+        return b''.join(self.parts)
+
+
+class Reader:
+    """
+    Reads fields back in the order a Writer wrote them
+    """
+
+    def __init__(self, data: bytes, offset: int = 0):
+        self.data = data
+        self.offset = offset
+
+    def unpack(self, layout):
+        value = layout.unpack_from(self.data, self.offset)[0]
+        self.offset += layout.size
+        return value
+
+    def int(self):
+        return self.unpack(INT)
+
+    def float(self):
+        return self.unpack(FLOAT)
+
+    def bool(self):
+        value = self.data[self.offset] != 0
+        self.offset += 1
+        return value
+
+    def bytes(self):
+        length = self.unpack(LENGTH)
+        value = self.data[self.offset:self.offset + length]
+        if len(value) != length:
+            raise ValueError('Record is cut short')
+        self.offset += length
+        return value
+
+    def string(self):
+        return self.bytes().decode('utf-8')
+
+    def value(self):
+        return json.loads(self.string())
+
+    def time(self):
+        ms = self.int()
+        return None if ms == NO_TIME else LapTime(ms)
+
+    def optional_int(self):
+        value = self.int()
+        return None if value == NO_TIME else value
+
+    def ints(self):
+        values = array('i')
+        values.frombytes(self.bytes())
+        return values
+
+
+# FILES
+
+def file_header(version: int = SCHEMA_VERSION):
+    return FILE_HEADER.pack(MAGIC, version)
+
+
+def read_file_header(data: bytes):
+    """
+    Returns the schema version, or raises ValueError
+    """
+
+    if len(data) < FILE_HEADER.size:
+        raise ValueError('Not a driver file')
+    magic, version = FILE_HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise ValueError('Not a driver file')
+    if version > SCHEMA_VERSION:
+        raise ValueError(f'Written by a newer version (schema {version})')
+
+    return version
+
+
+def frame(record: bytes):
+    return LENGTH.pack(len(record)) + record
+
+
+def read_frames(data: bytes, offset: int):
+    """
+    Length prefixed records from offset onwards.
+    Returns (records, complete) where complete is False if the
+    last record was cut short.
+    """
+
+    records = []
+    while offset < len(data):
+        if offset + LENGTH.size > len(data):
+            return records, False
+        length = LENGTH.unpack_from(data, offset)[0]
+        offset += LENGTH.size
+        if offset + length > len(data):
+            return records, False
+        records.append(data[offset:offset + length])
+        offset += length
+
+    return records, True
+
+
+# RACES
+
+def encode_race(race):
+    writer = Writer()
+
+    writer.int(race.session_id)
+    writer.string(race.track)
+    writer.string(race.date)
+    writer.int(race.epoch)
+    writer.value(race.weather)
+    writer.value(race.event_id)
+    writer.string(race.url)
+    writer.value(race.mandatory_pitstops)
+    writer.value(race.split)
+    writer.value(race.car_class)
+    writer.value(race.car_name)
+    writer.value(race.car_year)
+    writer.value(race.start_position)
+    writer.value(race.finish_position)
+    writer.value(race.incidents)
+    writer.time(race.best_lap)
+    writer.value(race.total_time)
+    writer.bool(race.dnf)
+    writer.bool(race.dns)
+    writer.value(race.gap)
+    writer.value(race.driver_elo)
+    writer.value(race.driver_safety_rating)
+    writer.int(race.valid_laps)
+    writer.int(race.invalid_laps)
+    writer.int(race.countable_laps)
+    writer.value(race.valid_lap_percentage)
+    writer.value(race.invalid_lap_percentage)
+
+    writer.int(len(race.best))
+    for key, value in race.best.items():
+        writer.string(key)
+        writer.time(value)
+
+    analysis = race.analysis
+    for key in ('hypothetical', 'average'):
+        writer.bool(key in analysis)
+        if key in analysis:
+            write_lap(writer, analysis[key])
+    writer.bool('consistency' in analysis)
+    if 'consistency' in analysis:
+        writer.value(analysis['consistency'])
+
+    write_laps(writer, race.laps)
+
+    return writer.output()
+
+
+def write_lap(writer, lap):
+    writer.int(lap.number)
+    writer.bool(lap.valid)
+    writer.ints([sector.number for sector in lap.sectors])
+    writer.ints([sector.time.ms for sector in lap.sectors])
+
+
+def read_lap(reader):
+    lap = Lap(reader.int())
+    if not reader.bool():
+        lap.invalidate()
+    numbers = reader.ints()
+    times = reader.ints()
+    for number, ms in zip(numbers, times):
+        lap.add_sector(Sector(LapTime(ms), number))
+
+    return lap
+
+
+def write_laps(writer, laps):
+    """
+    A race's LapTable as it is held in memory: lap numbers,
+    the validity bitmap, sectors per lap, then every sector time.
+    """
+
+    writer.ints(laps.numbers)
+    writer.bytes(laps.valid)
+    writer.ints(laps.counts)
+    writer.ints(laps.times)
+
+
+def read_laps(reader):
+    numbers = reader.ints()
+    valid = reader.bytes()
+    counts = reader.ints()
+    times = reader.ints()
+
+    return LapTable(numbers, valid, counts, times)
+
+
+def decode_race_v1(reader):
+    fields = {}
+
+    fields['session_id'] = reader.int()
+    fields['track'] = reader.string()
+    fields['date'] = reader.string()
+    fields['epoch'] = reader.int()
+    fields['weather'] = reader.value()
+    fields['event_id'] = reader.value()
+    fields['url'] = reader.string()
+    fields['mandatory_pitstops'] = reader.value()
+    fields['split'] = reader.value()
+    fields['car_class'] = reader.value()
+    fields['car_name'] = reader.value()
+    fields['car_year'] = reader.value()
+    fields['start_position'] = reader.value()
+    fields['finish_position'] = reader.value()
+    fields['incidents'] = reader.value()
+    fields['best_lap'] = reader.time()
+    fields['total_time'] = reader.value()
+    fields['dnf'] = reader.bool()
+    fields['dns'] = reader.bool()
+    fields['gap'] = reader.value()
+    fields['driver_elo'] = reader.value()
+    fields['driver_safety_rating'] = reader.value()
+    fields['valid_laps'] = reader.int()
+    fields['invalid_laps'] = reader.int()
+    fields['countable_laps'] = reader.int()
+    fields['valid_lap_percentage'] = reader.value()
+    fields['invalid_lap_percentage'] = reader.value()
+
+    fields['best'] = {}
+    for _ in range(reader.int()):
+        key = reader.string()
+        fields['best'][key] = reader.time()
+
+    fields['analysis'] = {}
+    for key in ('hypothetical', 'average'):
+        if reader.bool():
+            fields['analysis'][key] = read_lap(reader)
+    if reader.bool():
+        fields['analysis']['consistency'] = reader.value()
+
+    fields['laps'] = read_laps(reader)
+
+    return fields
+
+
+# Races are laid out the same in version 2
+RACE_DECODERS = {
+    1: decode_race_v1,
+    2: decode_race_v1,
+}
+
+# version -> function taking that version's fields to the next version's
+RACE_MIGRATIONS = {
+    1: lambda fields: fields,
+}
+
+
+def decode_race(record: bytes, version: int = SCHEMA_VERSION):
+    fields = RACE_DECODERS[version](Reader(record))
+    fields = upgrade(fields, version, RACE_MIGRATIONS)
+
+    race = Race.__new__(Race)
+    for key, value in fields.items():
+        setattr(race, key, value)
+    return race
+
+
+def race_session_id(record: bytes, version: int = SCHEMA_VERSION):
+    """
+    Just the session id, without decoding the rest of the record.
+    Every version so far writes it first.
+    """
+
+    return INT.unpack_from(record, 0)[0]
+
+
+# DRIVER HEADER
+
+def encode_header(header: dict):
+    writer = Writer()
+
+    writer.string(header['name'])
+    writer.string(header['notes'])
+    writer.int(header['races'])
+    writer.int(header['wins'])
+    writer.int(header['podiums'])
+    writer.int(header['dnf'])
+    writer.int(header['dns'])
+    writer.int(header['incident_points'])
+    writer.float(header['incident_points_per_race'])
+    writer.value(header['elo'])
+    writer.value(header['safety_rating'])
+    writer.int(header['countable_laps'])
+    writer.int(header['valid_laps'])
+    writer.int(header['invalid_laps'])
+    writer.bool(header['complete'])
+    write_tracks(writer, header['tracks'])
+
+    return writer.output()
+
+
+def write_tracks(writer, tracks):
+    writer.int(len(tracks))
+    for track, cars in tracks.items():
+        writer.string(track)
+        writer.int(len(cars))
+        for car, stats in cars.items():
+            writer.string(car)
+            writer.int(stats.races)
+            writer.optional_int(stats.best_ms)
+            writer.int(stats.average_count)
+            writer.int(stats.average_sum)
+            writer.optional_int(stats.average_min)
+            writer.optional_int(stats.average_max)
+            writer.int(stats.valid_laps)
+            writer.int(stats.invalid_laps)
+            writer.int(stats.countable_laps)
+
+
+def read_tracks(reader):
+    tracks = TrackStats()
+    for _ in range(reader.int()):
+        track = reader.string()
+        for _ in range(reader.int()):
+            stats = tracks.car(track, reader.string())
+            stats.races = reader.int()
+            stats.best_ms = reader.optional_int()
+            stats.average_count = reader.int()
+            stats.average_sum = reader.int()
+            stats.average_min = reader.optional_int()
+            stats.average_max = reader.optional_int()
+            stats.valid_laps = reader.int()
+            stats.invalid_laps = reader.int()
+            stats.countable_laps = reader.int()
+
+    return tracks
+
+
+def read_header_fields(reader):
+    """
+    Everything before the tracks, the same in every version so far
+    """
+
+    header = {}
+
+    header['name'] = reader.string()
+    header['notes'] = reader.string()
+    header['races'] = reader.int()
+    header['wins'] = reader.int()
+    header['podiums'] = reader.int()
+    header['dnf'] = reader.int()
+    header['dns'] = reader.int()
+    header['incident_points'] = reader.int()
+    header['incident_points_per_race'] = reader.float()
+    header['elo'] = reader.value()
+    header['safety_rating'] = reader.value()
+    header['countable_laps'] = reader.int()
+    header['valid_laps'] = reader.int()
+    header['invalid_laps'] = reader.int()
+    header['complete'] = reader.bool()
+
+    return header
+
+
+def decode_header_v1(reader):
+    # Version 1 kept the old nested dicts, with every race's average lap
+    header = read_header_fields(reader)
+    header['tracks'] = reader.value()
+    return header
+
+
+def decode_header_v2(reader):
+    header = read_header_fields(reader)
+    header['tracks'] = read_tracks(reader)
+    return header
+
+
+def migrate_header_v1(header: dict):
+    header['tracks'] = TrackStats.from_legacy(header['tracks'])
+    return header
+
+
+HEADER_DECODERS = {
+    1: decode_header_v1,
+    2: decode_header_v2,
+}
+
+HEADER_MIGRATIONS = {
+    1: migrate_header_v1,
+}
+
+
+def decode_header(record: bytes, version: int = SCHEMA_VERSION):
+    header = HEADER_DECODERS[version](Reader(record))
+    return upgrade(header, version, HEADER_MIGRATIONS)
+
+
+def upgrade(fields: dict, version: int, migrations: dict):
+    while version < SCHEMA_VERSION:
+        fields = migrations[version](fields)
+        version += 1
+
+    return fields
@@ -1,22 +1,58 @@
 import json
-import time
-import pickle
+import multiprocessing
 import textwrap
+import threading
+from bisect import bisect_left, bisect_right
 from datetime import datetime
 
-from os import path, remove
+from os import cpu_count, getpid, path, replace
 
-from classes.race import Race, compare_times, average_time, http_request
-from classes.printing import print_side_by_side, replace_print, colored
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from classes.http_client import HttpError, http_request
+from classes.race import Race
+from classes.session import cache_exists, prefetch_sessions, FETCH_WORKERS
+from classes.session_cache import session_cache
+from classes.shared_index import shared_index
+from classes.chat_index import chat_index
+from classes.listing import delete_listing, load_high_water_mark, reached_mark, load_listing, save_listing
+from classes.storage import DriverStorage, saved_driver_ids
+from classes.track_stats import TrackStats
+from classes.reports import report_cache
+from classes.printing import print_side_by_side, quiet_thread, replace_print, colored
 
 PICKLE_DIR = './pickles/'
 JSON_DIR = './json/'
+
+# Counters for every driver, so the CLI can start without
+# unpickling everyone's full session history
+SUMMARY_FILE = f'{PICKLE_DIR}summary.json'
+SUMMARY_FIELDS = [
+    'name', 'notes', 'wins', 'podiums', 'dnf', 'dns', 'races', 'incident_points',
+    'incident_points_per_race', 'elo', 'safety_rating', 'countable_laps',
+    'valid_laps', 'invalid_laps', 'complete'
+]
+summary_lock = threading.Lock()
+
+# Written to the small header record on every save.  The sessions
+# themselves go to the append-only log.
+HEADER_FIELDS = SUMMARY_FIELDS + ['tracks']
 BASE_URL = 'https://api2.lowfuelmotorsport.com/api/'
 
+# How many drivers 'update all' works on at the same time.
+# Their requests interleave through the shared request scheduler.
+UPDATE_WORKERS = 4
+
+# How many processes 'rebuild all' uses.  Rebuilding only reads
+# the caches, so it's bound by the CPU, not the API.
+REBUILD_WORKERS = cpu_count() or 1
+
 class Driver:
     id: int
     name: str
-    sessions: list
+    sessions: list              # newest first
+    session_index: dict         # session_id -> Race
+    session_keys: list          # -epoch of each entry in sessions, for bisect
     save_file: str
     json_file: str
     notes: str
@@ -28,7 +64,7 @@ class Driver:
     incident_points: int
     url: str
     incident_points_per_race: float
-    tracks: dict
+    tracks: TrackStats
     elo: int
     safety_rating: float
     countable_laps: int
@@ -39,14 +75,24 @@ class Driver:
     # (Sessions might be cut short if script crashed during an update.)
     complete: bool
 
-    def __init__(self, id: int):
+    # False while only the summary has been read.  sessions and tracks
+    # are loaded from the pickle the first time they're needed.
+    loaded: bool
+
+    def __init__(self, id: int, summary: dict = None, write_summary: bool = True):
+        """
+        summary: the driver's entry from the summary file, if there is one
+        write_summary: update the summary file if the entry was out of date
+        """
         
 
+        self.loaded = True
         self.name = ''
         self.id = int(id)
         self.url = f'https://lowfuelmotorsport.com/profile/{self.id}'
-        self.sessions = []
+        self.reset_sessions()
         self.notes = ''
+        self.races = 0
         self.wins = 0
         self.podiums = 0
         self.incident_points = 0
@@ -55,72 +101,219 @@ class Driver:
         self.dns = 0
         self.elo = 0
         self.safety_rating = 0.0
-        self.tracks = {}
+        self.tracks = TrackStats()
         self.complete = False
         self.countable_laps = 0
         self.valid_laps = 0
         self.invalid_laps = 0
 
         
-        self.save_file = f'{PICKLE_DIR}{self.id}.pkl'
-        exists = pickle_load(self.save_file)
-
-        
-        
-
-        if exists:
-            self.name = exists.name
-            self.id = exists.id
-            self.sessions = exists.sessions
+        self.storage = DriverStorage(self.id, PICKLE_DIR)
+        self.save_file = self.storage.snapshot_file
+        self.unsaved_sessions = []
+        self.rewrite = False
+
+        if summary_is_current(summary, self.storage):
+            for field in SUMMARY_FIELDS:
+                setattr(self, field, summary[field])
             self.json_file = f'{JSON_DIR}{self.name}.json'
-            self.wins = exists.wins
-            self.podiums = exists.podiums
-            self.notes = exists.notes
-            self.incident_points = exists.incident_points
-            self.incident_points_per_race = exists.incident_points_per_race
-            self.url = f'https://lowfuelmotorsport.com/profile/{self.id}'
-            self.dns = exists.dns
-            self.dnf = exists.dnf
-            self.tracks = exists.tracks
-            
-            self.safety_rating = exists.safety_rating
-            self.complete = exists.complete
-            
-            if type(exists.elo) == int:
-                self.elo = exists.elo
-            
-            try:
-                self.countable_laps = exists.countable_laps
-                self.valid_laps = exists.valid_laps
-                self.invalid_laps = exists.invalid_laps
-            except:
-                self.countable_laps = 0
-                self.valid_laps = 0
-                self.invalid_laps = 0
+            self.loaded = False
+            return
+
+        if self.load_storage():
+            if write_summary:
+                save_summary(self)
 
         else:
-            pickle_save(self.save_file, self)
+            self.save(write_summary)
 
 
         self.races = len(self.sessions)
 
+    def __setstate__(self, state):
+        # Drivers saved before the codec were pickled whole.
+        # DriverStorage reads them through here.
+        state['_sessions'] = state.pop('sessions', [])
+        state['_tracks'] = state.pop('tracks', {})
+        self.__dict__.update(state)
+        self.loaded = True
+
+    @property
+    def sessions(self):
+        self.ensure_loaded()
+        return self._sessions
+
+    @sessions.setter
+    def sessions(self, sessions: list):
+        self._sessions = sessions
+
+    @property
+    def tracks(self):
+        self.ensure_loaded()
+        return self._tracks
+
+    @tracks.setter
+    def tracks(self, tracks: TrackStats):
+        self._tracks = tracks
+
+    def ensure_loaded(self):
+        """
+        Read the full session history if we only have the summary
+        """
+
+        if self.loaded:
+            return
+
+        self.loaded = True
+        self.load_storage()
+
+    def load_storage(self):
+        """
+        Read the saved header and sessions.
+        Returns False if nothing has been saved for this driver.
+        """
+
+        saved = self.storage.load()
+        if saved is None:
+            return False
+
+        header, sessions = saved
+        for field in HEADER_FIELDS:
+            setattr(self, field, header[field])
+        self.json_file = f'{JSON_DIR}{self.name}.json'
+
+        # A crash during compaction can leave a session in both places
+        unique = {}
+        for race in sessions:
+            unique.setdefault(race.session_id, race)
+        self.reset_sessions(list(unique.values()))
+        self.races = len(self.sessions)
+
+        return True
+
+    def header(self):
+        return {field: getattr(self, field) for field in HEADER_FIELDS}
+
+    def save(self, summary: bool = True):
+        """
+        Append new sessions to the journal and rewrite the header.
+        Every so often the journal is folded into a new snapshot.
+
+        summary: also write the driver to the summary file
+        """
+
+        self.ensure_loaded()
+        if self.rewrite or self.storage.needs_compaction():
+            self.storage.compact(self.header(), self.sessions)
+            self.rewrite = False
+        else:
+            self.storage.append_sessions(self.unsaved_sessions)
+            self.storage.write_header(self.header())
+
+        self.unsaved_sessions = []
+        if summary:
+            save_summary(self)
+
+    def summary(self):
+        output = {field: getattr(self, field) for field in SUMMARY_FIELDS}
+        output['id'] = self.id
+        output['modified'] = self.storage.modified()
+        return output
+
+    def reset_sessions(self, sessions: list = None):
+        """
+        Replace the session list and rebuild the lookups
+        """
+
+        if '_sessions' in self.__dict__:
+            shared_index.remove_driver(self)
+
+        self.sessions = sort_races(sessions or [])
+        self.session_keys = [-race.epoch for race in self.sessions]
+        self.session_index = {race.session_id: race for race in self.sessions}
+        shared_index.add_driver(self)
+
+    def add_session(self, race):
+        """
+        Insert a Race in date order.  Returns False if we already had it.
+        """
+
+        self.ensure_loaded()
+        if race.session_id in self.session_index:
+            return False
+
+        position = bisect_right(self.session_keys, -race.epoch)
+        self.session_keys.insert(position, -race.epoch)
+        self.sessions.insert(position, race)
+        self.session_index[race.session_id] = race
+        self.unsaved_sessions.append(race)
+        shared_index.add(self, race)
+        chat_index.session_added(race)
+
+        return True
+
+    def sessions_between_epochs(self, start: int, end: int):
+        """
+        Sessions from start to end (inclusive), newest first
+        """
+
+        self.ensure_loaded()
+        first = bisect_left(self.session_keys, -end)
+        last = bisect_right(self.session_keys, -start)
+        return self.sessions[first:last]
+
+    def sessions_between_dates(self, start: str, end: str):
+        """
+        Sessions between two dates (YYYY-MM-DD, both days included), newest first
+        """
+
+        start_epoch = int(datetime.strptime(start, '%Y-%m-%d').timestamp())
+        end_epoch = int(datetime.strptime(end, '%Y-%m-%d').timestamp()) + (24 * 60 * 60) - 1
+        return self.sessions_between_epochs(start_epoch, end_epoch)
+
     def update_notes(self, notes: str):
+        self.ensure_loaded()
         self.notes = notes
-        pickle_save(self.save_file, self)
+        self.save()
+        report_cache.bump()
 
     def delete(self):
         """
-        Deletes the pickle file.  Driver will not be loaded next time.
+        Deletes the saved files.  Driver will not be loaded next time.
         """
 
-        remove(self.save_file)
+        self.storage.delete()
+        delete_listing(self.id)
+        remove_summary(self.id)
+        shared_index.remove_driver(self)
+        report_cache.bump()
 
 
     def force_update(self):
         """
         Force a refresh of all sessions
         """
-        self.sessions = []
+        self.reset_stats()
+        self.complete = False
+        try:
+            self.gather_sessions()
+        except Exception:
+            # Nothing was saved since the reset.  Go back to what's
+            # on disk so a later save doesn't write the empty driver.
+            self.rewrite = False
+            self.unsaved_sessions = []
+            self.load_storage()
+            raise
+
+    def reset_stats(self):
+        """
+        Drop every session and zero the counters.
+        Name and notes are kept.  The next save rewrites the snapshot.
+        """
+
+        self.ensure_loaded()
+        self.reset_sessions()
+        self.rewrite = True
         self.races = 0
         self.wins = 0
         self.dns = 0
@@ -128,14 +321,12 @@ class Driver:
         self.podiums = 0
         self.incident_points = 0
         self.incident_points_per_race = 0.0
-        self.tracks = {}
-        self.complete = False
+        self.tracks = TrackStats()
         self.countable_laps = 0
         self.valid_laps = 0
         self.invalid_laps = 0
         self.elo = 0
         self.safety_rating = 0
-        self.gather_sessions()
 
     def print(self):
         print()
@@ -147,25 +338,55 @@ class Driver:
         """
         Same as print, but returns a string instead of output to console
         """
-        if colorful:
-            output = f'{colored(self.name, "blue")} ({self.elo} elo, {self.safety_rating} sr)\n'
-        else:
-            output = f'{self.name} ({self.id})\n'
+        return card_text(self.card(), colorful)
 
-        output = f'{output}{self.url}\n' 
-        output = f'{output}{self.races} sessions {self.dns} ({percentage(self.dns, self.races)}) DNS, {self.dnf} ({percentage(self.dnf, self.races)}) DNF\n'
-        output = f'{output}{self.valid_laps:,} ({percentage(self.valid_laps, self.countable_laps)}) valid, {self.invalid_laps:,} ({percentage(self.invalid_laps, self.countable_laps)}) invalid laps.\n'
-        output = f'{output}{self.wins} wins, {self.podiums} podiums\n'
-        output = f'{output}{self.incident_points_per_race} incidents per race\n'
-        output = f'{output}Notes: {textwrap.fill(self.notes, 50)}\n'
+    def card(self):
+        """
+        What text() shows, as plain values
+        """
 
-        return output
-    def gather_sessions(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'url': self.url,
+            'elo': self.elo,
+            'safety_rating': self.safety_rating,
+            'races': self.races,
+            'dns': self.dns,
+            'dns_percentage': percentage(self.dns, self.races),
+            'dnf': self.dnf,
+            'dnf_percentage': percentage(self.dnf, self.races),
+            'valid_laps': self.valid_laps,
+            'valid_percentage': percentage(self.valid_laps, self.countable_laps),
+            'invalid_laps': self.invalid_laps,
+            'invalid_percentage': percentage(self.invalid_laps, self.countable_laps),
+            'wins': self.wins,
+            'podiums': self.podiums,
+            'incident_points_per_race': self.incident_points_per_race,
+            'notes': textwrap.fill(self.notes, 50),
+        }
+    def gather_sessions(self, workers: int = FETCH_WORKERS):
         """
         Pupulate an array of dictionaries containing
         basic info about the session
+
+        workers: how many sessions to download at the same time
+        """
+
+        data = self.fetch_listing()
+        self.add_races(data, workers)
+        # Saved after the races, so a failed update is fetched again next time
+        save_listing(self.id, data)
+        self.mark_complete()
+
+    def fetch_listing(self):
+        """
+        The users/getUsersPastRaces rows we don't have yet, newest first
+        (plus the rest of the page where we caught up)
         """
 
+        self.ensure_loaded()
+
         # New driver?  Grab a bunch at a time.
         # Established driver?  Grab a few to avoid detection
 
@@ -177,8 +398,13 @@ class Driver:
         if self.name != '':
             print(f'Updating sessions for {self.name}...')
 
+        # Once we have everything back to the first race, only
+        # the rows newer than the newest saved row are needed
+        mark = load_high_water_mark(self.id) if self.complete else None
+
         start = 0
         data = []
+        seen = set()
         while True:
             url = f'{BASE_URL}users/getUsersPastRaces/{self.id}?start={start}&limit={at_a_time}'
             # print(url)
@@ -188,120 +414,120 @@ class Driver:
             if len(new_results) == 0:
                 break
 
-            data += new_results
+            # A race finishing while we page shifts everything down a row
+            for result in new_results:
+                if result['race_id'] not in seen:
+                    seen.add(result['race_id'])
+                    data.append(result)
 
             if len(new_results) < at_a_time:
                 break
 
-            
-
-            start += at_a_time - 1
+            start += len(new_results)
 
             if self.complete:
                 # We know that we aren't missing any sessions from the user's beginning.
-                # Keep checking for new sessions up until the point where we find an
-                # already existing one.
+                # Keep checking for new sessions up until the point where we reach
+                # the high-water mark or an already existing one.
                 breakout = False
                 for result in new_results:
-                    id = result['race_id']
-                    if self.session_exists(id):
+                    if reached_mark(result, mark) or self.session_exists(result['race_id']):
                         breakout = True
                         break
 
                 if breakout:
                     break
 
-            time.sleep(.25)
-            
+        return data
+
+    def mark_complete(self, summary: bool = True):
+        """
+        Every race back to the first one has been added and the
+        listing saved, so later updates can stop at the mark
+        """
+
+        if not self.complete:
+            self.complete = True
+            self.save(summary)
+
+    def add_races(self, rows: list, workers: int = FETCH_WORKERS, summary: bool = True):
+        """
+        Add a Race for each users/getUsersPastRaces row we don't
+        have yet, update the counters and save.
+
+        summary: also write the driver to the summary file
+        """
 
         added_session_counter = 0
+
+        # Download everything we're missing up front, in parallel
+        new_session_ids = [race['race_id'] for race in rows if not self.session_exists(race['race_id'])]
+        # Evictions on other threads keep these until the driver is saved
+        session_cache.pin(new_session_ids)
+        try:
+            prefetch_sessions(new_session_ids, workers)
       
-        for race in data:
-            if self.name == '':
-                driver_data = json.loads(race['driver_data'])
-                self.name = f"{driver_data['vorname']} {driver_data['nachname']}"
-                print(f'Updating sessions for {self.name}...')
-                self.json_file = f'{JSON_DIR}{self.name}.json'
-                pickle_save(self.save_file, self)
+            for race in rows:
+                if self.name == '':
+                    driver_data = json.loads(race['driver_data'])
+                    self.name = f"{driver_data['vorname']} {driver_data['nachname']}"
+                    print(f'Updating sessions for {self.name}...')
+                    self.json_file = f'{JSON_DIR}{self.name}.json'
+                    self.save(summary)
 
-            if not self.session_exists(race['race_id']):
-                start = race['start_pos']
-                finish = race['finishing_pos']
+                if not self.session_exists(race['race_id']):
+                    start = race['start_pos']
+                    finish = race['finishing_pos']
 
-                new_race = Race(race['race_id'], self.id)
+                    new_race = Race(race['race_id'], self.id)
 
-                new_race.set_start_position(start)
-                new_race.set_finish_position(finish)
-                self.sessions.append(new_race)
-                added_session_counter += 1
+                    new_race.set_start_position(start)
+                    new_race.set_finish_position(finish)
+                    self.add_session(new_race)
+                    added_session_counter += 1
 
 
 
-                self.incident_points += new_race.incidents
+                    self.incident_points += new_race.incidents
                 
 
-                if finish == 1:
-                    self.wins += 1
-                if finish <=3:
-                    self.podiums += 1
-
-                if new_race.dns:
-                    self.dns += 1
-                if new_race.dnf:
-                    self.dnf += 1
-
-                if not new_race.dns:
-                    if len(new_race.laps) > 0:
-                        track = new_race.track
-                        if track not in self.tracks:
-                            self.tracks[track] = {}
-                        
-                        car = f'{new_race.car_year} {new_race.car_name}'
-                        if car not in self.tracks[track]:
-                            self.tracks[track][car] = {
-                                'races': 0,
-                                'best': '10:59.999',
-                                'average_laps': [],
-                                'average': None,
-                                'valid_laps': 0,
-                                'invalid_laps': 0,
-                                'countable_laps': 0 # We don't count Lap 1, and if (mandatory pitstop = true AND invalid laps > 1, we subtract 2)
-                            }
-
-                        self.tracks[track][car]['countable_laps'] += new_race.countable_laps
-                        self.tracks[track][car]['valid_laps'] += new_race.valid_laps
-                        self.tracks[track][car]['invalid_laps'] += new_race.invalid_laps
-
-                        self.countable_laps += new_race.countable_laps
-                        self.valid_laps += new_race.valid_laps
-                        self.invalid_laps += new_race.invalid_laps
-
-
-                        self.tracks[track][car]['races'] += 1
-                        compared = compare_times(self.tracks[track][car]['best'], new_race.best_lap)
-                        if compared < 0:
-                            self.tracks[track][car]['best'] = new_race.best_lap
-                        
-                        if new_race.analysis['average'].time != '00:00.000':
-                            self.tracks[track][car]['average_laps'].append(new_race.analysis['average'].time)
-                            self.tracks[track][car]['average'] = average_time(self.tracks[track][car]['average_laps'])
-
-
-        self.sessions = sort_races(self.sessions)
-        self.races = len(self.sessions)
+                    if finish == 1:
+                        self.wins += 1
+                    if finish <=3:
+                        self.podiums += 1
 
+                    if new_race.dns:
+                        self.dns += 1
+                    if new_race.dnf:
+                        self.dnf += 1
 
-        # Grab ELO and safety from most recent session (first in list)
-        most_recent = self.sessions[0]
-        if type(most_recent.driver_elo) == int:
-            self.elo = most_recent.driver_elo
-        else:
-            self.elo = 0
-        self.safety_rating = most_recent.driver_safety_rating
+                    if not new_race.dns:
+                        if len(new_race.laps) > 0:
+                            self.tracks.add_race(new_race)
 
+                            self.countable_laps += new_race.countable_laps
+                            self.valid_laps += new_race.valid_laps
+                            self.invalid_laps += new_race.invalid_laps
 
-        self.incident_points_per_race = round(self.incident_points / self.races, 2)
-        pickle_save(self.save_file, self)
+
+            self.races = len(self.sessions)
+
+
+            # Grab ELO and safety from most recent session (first in list)
+            # (A driver with no races yet has neither)
+            if self.races > 0:
+                most_recent = self.sessions[0]
+                if type(most_recent.driver_elo) == int:
+                    self.elo = most_recent.driver_elo
+                else:
+                    self.elo = 0
+                self.safety_rating = most_recent.driver_safety_rating
+
+                self.incident_points_per_race = round(self.incident_points / self.races, 2)
+            self.save(summary)
+        finally:
+            session_cache.unpin(new_session_ids)
+        report_cache.bump()
         replace_print('')
         print('', end='')
         
@@ -313,8 +539,6 @@ class Driver:
                 f'  added {colored(added_session_counter, "blue")} session{s} for {self.name}{" " * 30}'
             )
 
-        self.complete = True
-
     def common(self, number_of_opponents: int = 6, name_filter: str = ''):
         """
         Return a list of the most common opponents.
@@ -371,7 +595,7 @@ class Driver:
                 'sessions': [],
                 'notes': self.notes,
                 'incidents per race': self.incident_points_per_race,
-                'tracks': self.tracks
+                'tracks': self.tracks.json()
             }
         
         for session in self.sessions:
@@ -385,11 +609,8 @@ class Driver:
         Check to see if a session id has alredy been added
         """
 
-        for session in self.sessions:
-            if session.session_id == session_id:
-                return True
-
-        return False
+        self.ensure_loaded()
+        return session_id in self.session_index
 
 
     def return_session(self, session_id: int):
@@ -397,11 +618,8 @@ class Driver:
         If found, returns a Race based on session id
         """
 
-        for session in self.sessions:
-            if session.session_id == session_id:
-                return session
-
-        return None
+        self.ensure_loaded()
+        return self.session_index.get(session_id)
 
     def return_sessions_by_term(self, search_terms: str):
         """
@@ -433,6 +651,201 @@ class Driver:
         return output
 
 
+def update_drivers(drivers: list, force: bool = False, workers: int = UPDATE_WORKERS):
+    """
+    Update several drivers at the same time.
+    Returns a list of (driver, HttpError) for the ones that failed.
+    """
+
+    def update(driver):
+        try:
+            if force:
+                driver.force_update()
+            else:
+                driver.gather_sessions()
+        except HttpError as e:
+            return (driver, e)
+
+        return None
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        results = list(pool.map(update, drivers))
+
+    return [result for result in results if result]
+
+
+def add_drivers(driver_ids: list, workers: int = UPDATE_WORKERS, fetch_workers: int = FETCH_WORKERS):
+    """
+    Start tracking several drivers at once, in stages: every driver's
+    past-races listing (in parallel), then each session any of them
+    raced in (downloaded once, however many of them shared it), then
+    their Races.
+
+    Returns a list of (driver id, Driver or None, the error or None).
+    Drivers that fail, or that have no races to add, are deleted
+    again unless they were saved before.
+    """
+
+    saved = set(saved_driver_ids(PICKLE_DIR))
+    drivers = [Driver(driver_id) for driver_id in driver_ids]
+
+    def listing(driver):
+        try:
+            rows = driver.fetch_listing()
+        except Exception as e:
+            return None, e
+        if len(rows) == 0 and driver.id not in saved:
+            return None, ValueError(f'no past races found for driver {driver.id}')
+
+        return rows, None
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        listings = list(pool.map(listing, drivers))
+
+    session_ids = set()
+    for driver, (rows, error) in zip(drivers, listings):
+        if error is None:
+            session_ids.update(row['race_id'] for row in rows if not driver.session_exists(row['race_id']))
+
+    # Kept out of the cache's evictions until every driver is saved
+    session_cache.pin(session_ids)
+    try:
+        # An error here leaves the rest to each driver's own prefetch
+        try:
+            prefetch_sessions(sorted(session_ids, reverse=True), fetch_workers)
+        except Exception:
+            pass
+
+        output = []
+        for driver, (rows, error) in zip(drivers, listings):
+            if error is None:
+                try:
+                    driver.add_races(rows, fetch_workers)
+                    save_listing(driver.id, rows)
+                    driver.mark_complete()
+                except Exception as e:
+                    error = e
+            if error is None and driver.name == '':
+                error = ValueError(f'no name found for driver {driver.id}')
+
+            if error is not None and driver.id not in saved:
+                driver.delete()
+            output.append((driver.id, driver if error is None else None, error))
+    finally:
+        session_cache.unpin(session_ids)
+
+    return output
+
+
+def rebuild_driver(driver_id: int, summary: dict = None):
+    """
+    Build a driver again from the cached past-races listing and
+    the session cache, without going to the API.  Runs in a
+    rebuild_drivers worker process.
+
+    Returns (driver id, summary, error).  Nothing is saved on error.
+    """
+
+    quiet_thread()
+    try:
+        # The parent writes every summary once the workers are done
+        driver = Driver(driver_id, summary, write_summary=False)
+
+        # Drivers saved before listings were kept, or only updated
+        # since, have races the listing doesn't cover.  The saved
+        # races have everything the listing rows are used for.
+        rows = {
+            race.session_id: {'race_id': race.session_id, 'start_pos': race.start_position, 'finishing_pos': race.finish_position}
+            for race in driver.sessions
+        }
+        for row in load_listing(driver_id) or []:
+            rows[row['race_id']] = row
+        rows = list(rows.values())
+
+        if len(rows) == 0:
+            return (driver_id, None, 'no saved races')
+
+        missing = [row['race_id'] for row in rows if not cache_exists(row['race_id'])]
+        if missing:
+            return (driver_id, None, f'{len(missing)} sessions are not in the session cache')
+
+        driver.reset_stats()
+        driver.add_races(rows, summary=False)
+
+    except Exception as e:
+        return (driver_id, None, f'{type(e).__name__}: {e}')
+
+    return (driver_id, driver.summary(), None)
+
+
+def rebuild_drivers(drivers: dict, workers: int = REBUILD_WORKERS):
+    """
+    Rebuild drivers (id -> summary) with rebuild_driver,
+    one driver per process.  Writes the new summaries.
+    Returns a list of (driver id, error) for the ones that failed.
+    """
+
+    # spawn, not fork: the parent's threads, locks and
+    # cache connections don't carry over to a forked child
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=max(1, workers), mp_context=context) as pool:
+        results = list(pool.map(rebuild_driver, drivers.keys(), drivers.values()))
+
+    save_summaries([summary for _, summary, error in results if error is None])
+
+    return [(driver_id, error) for driver_id, _, error in results if error is not None]
+
+
+def card_text(card: dict, colorful: bool = False):
+    if colorful:
+        output = f'{colored(card["name"], "blue")} ({card["elo"]} elo, {card["safety_rating"]} sr)\n'
+    else:
+        output = f'{card["name"]} ({card["id"]})\n'
+
+    output = f'{output}{card["url"]}\n' 
+    output = f'{output}{card["races"]} sessions {card["dns"]} ({card["dns_percentage"]}) DNS, {card["dnf"]} ({card["dnf_percentage"]}) DNF\n'
+    output = f'{output}{card["valid_laps"]:,} ({card["valid_percentage"]}) valid, {card["invalid_laps"]:,} ({card["invalid_percentage"]}) invalid laps.\n'
+    output = f'{output}{card["wins"]} wins, {card["podiums"]} podiums\n'
+    output = f'{output}{card["incident_points_per_race"]} incidents per race\n'
+    output = f'{output}Notes: {card["notes"]}\n'
+
+    return output
+
+
+def convert_pickles(drivers: list):
+    """
+    Save every driver still stored as pickles in the compact format.
+    Returns how many were converted.
+    """
+
+    converted = 0
+    for driver in drivers:
+        if driver.storage.is_legacy():
+            driver.ensure_loaded()
+            driver.rewrite = True
+            driver.save()
+            converted += 1
+
+    return converted
+
+
+def tracked_session_ids():
+    """
+    Every session a saved driver took part in.
+    These are never evicted from the session cache.
+    """
+
+    ids = shared_index.session_ids()
+    if path.exists(PICKLE_DIR):
+        for driver_id in saved_driver_ids(PICKLE_DIR):
+            ids |= DriverStorage(driver_id, PICKLE_DIR).session_ids()
+
+    return ids
+
+
+session_cache.pinned = tracked_session_ids
+
+
 # UTILITY FUNCTIONS
 
 def opponent_exists(opponent_name, opponent_list):
@@ -453,71 +866,83 @@ def json_from_file(file_name):
 
     
 def json_to_file(file_name, json_data):
-    with open(file_name, 'w') as out_file:
-        json.dump(json_data, out_file)
-
-def pickle_save(file_name, data):
-    pickle.dump(data, open(file_name, 'wb'))
+    # Written aside and moved into place, so nobody reads half a file
+    temp_file = f'{file_name}.{getpid()}.{threading.get_ident()}.tmp'
+    with open(temp_file, 'w') as out_file:
+        json.dump(json_data, out_file, default=str)
+    replace(temp_file, file_name)
 
-def pickle_load(file_name):
-    output = None
-    if path.exists(file_name):
-        output = pickle.load(open(file_name, 'rb'))
-
-    return output
 
 
-def compare_times(time_1: str, time_2: str):
+def load_summaries():
     """
-    Returns the difference between two times in seconds.
-    Accepts Minutes:Seconds.milliseconds
-    00:35.927
+    driver id -> summary
     """
 
-    t1 = datetime.strptime(time_1, '%M:%S.%f')
-    t2 = datetime.strptime(time_2, '%M:%S.%f')
+    if not path.exists(SUMMARY_FILE):
+        return {}
 
-    diff = t2 - t1
+    with summary_lock:
+        try:
+            summaries = json_from_file(SUMMARY_FILE)
+        except ValueError:
+            return {}
 
-    return diff.total_seconds()
+    return {int(driver_id): summary for driver_id, summary in summaries.items()}
 
 
+def save_summary(driver):
+    save_summaries([driver.summary()])
 
 
-def sort_races(races):
+def save_summaries(new_summaries: list):
+    with summary_lock:
+        summaries = {}
+        if path.exists(SUMMARY_FILE):
+            try:
+                summaries = json_from_file(SUMMARY_FILE)
+            except ValueError:
+                pass
+        for summary in new_summaries:
+            summaries[str(summary['id'])] = summary
+        json_to_file(SUMMARY_FILE, summaries)
 
-    temp = []
-    for race in races:
-        temp.append(
-            {
-                'session id': race.session_id,
-                'epoch': race.epoch
-            }
-        )
 
-    temp = sort_array_of_dicts(temp, 'epoch')
+def remove_summary(driver_id: int):
+    with summary_lock:
+        if not path.exists(SUMMARY_FILE):
+            return
+        summaries = json_from_file(SUMMARY_FILE)
+        summaries.pop(str(driver_id), None)
+        json_to_file(SUMMARY_FILE, summaries)
 
-    sorted_races = []
 
-    for item in temp:
-        sesh = item['session id']
-        for race in races:
-            if race.session_id == sesh:
-                sorted_races.append(race)
-                break
-    
-    return sorted_races
+def summary_is_current(summary: dict, storage):
+    """
+    A summary can stand in for the saved driver unless the
+    driver was saved again after it.
+    """
 
+    if not summary or not storage.exists():
+        return False
 
+    if any(field not in summary for field in SUMMARY_FIELDS):
+        return False
 
-def percentage(part, whole):
-    return f'{str(round(100 * float(part)/float(whole), 1))}%'
+    return summary.get('modified') == storage.modified()
 
 
-def sort_array_of_dicts(array: list, field: str, reverse: bool = True):
+def sort_races(races):
     """
-    Take an array of dicts and sort the array based on a key:value present in the dicts
+    Newest first
     """
 
-    return sorted(array, key=lambda d: d[field], reverse=reverse)
-# / END UTILITY FUNCTIONS
+    return sorted(races, key=lambda race: race.epoch, reverse=True)
+
+
+
+def percentage(part, whole):
+    if not whole:
+        return '0.0%'
+    return f'{str(round(100 * float(part)/float(whole), 1))}%'
+# / END UTILITY FUNCTIONS
\ No newline at end of file
@@ -0,0 +1,134 @@
+import random
+import time
+import requests
+
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from requests.adapters import HTTPAdapter
+
+from classes.scheduler import scheduler as shared_scheduler
+
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/70.0.3538.77 Safari/537.36"
+
+MAX_ATTEMPTS = 6
+TIMEOUT = 20            # seconds, per attempt
+BACKOFF = .5            # seconds, doubled after every failed attempt
+MAX_BACKOFF = 30
+POOL_SIZE = 16
+
+# Worth trying again.  Any other non-2xx response is final.
+RETRY_STATUSES = (408, 425, 429, 500, 502, 503, 504)
+
+
+class HttpError(Exception):
+    """
+    A request that failed for good, either with a final
+    status code or after running out of attempts.
+    """
+
+    def __init__(self, url: str, status: int = None, reason: str = ''):
+        self.url = url
+        self.status = status
+        self.reason = reason
+
+        message = f'Request failed for {url}'
+        if status is not None:
+            message = f'{message} (HTTP {status})'
+        if reason:
+            message = f'{message}: {reason}'
+        super().__init__(message)
+
+
+class HttpClient:
+    """
+    Shared requests.Session with connection pooling and
+    bounded retries with exponential backoff.
+    Every attempt waits its turn with the request scheduler.
+    """
+
+    def __init__(self, max_attempts: int = MAX_ATTEMPTS, timeout: float = TIMEOUT, backoff: float = BACKOFF, max_backoff: float = MAX_BACKOFF, pool_size: int = POOL_SIZE, scheduler=None):
+        self.scheduler = scheduler or shared_scheduler
+        self.max_attempts = max_attempts
+        self.timeout = timeout
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+        self.session = requests.Session()
+        self.session.headers.update({'User-Agent': USER_AGENT})
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def get(self, url: str):
+        """
+        GET a url, retrying on connection problems and retryable
+        status codes.  Raises HttpError when it gives up.
+        """
+
+        status = None
+        reason = ''
+        for attempt in range(1, self.max_attempts + 1):
+            wait = None
+            self.scheduler.wait_for(url)
+            try:
+                response = self.session.get(url, timeout=self.timeout)
+            except requests.RequestException as e:
+                reason = str(e)
+            else:
+                if response.ok:
+                    return response
+
+                status = response.status_code
+                reason = response.reason or ''
+                if status not in RETRY_STATUSES:
+                    raise HttpError(url, status, reason)
+
+                if status == 429:
+                    wait = retry_after(response)
+
+            if attempt < self.max_attempts:
+                if wait is None:
+                    wait = self.backoff_delay(attempt)
+                time.sleep(wait)
+
+        raise HttpError(url, status, reason or f'gave up after {self.max_attempts} attempts')
+
+    def backoff_delay(self, attempt: int):
+        """
+        Exponential backoff with full jitter
+        """
+
+        ceiling = min(self.max_backoff, self.backoff * (2 ** (attempt - 1)))
+        return random.uniform(0, ceiling)
+
+
+def retry_after(response):
+    """
+    Seconds to wait according to a Retry-After header, or None.
+    The header is either a number of seconds or an HTTP date.
+    """
+
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+
+    value = value.strip()
+    if value.isdigit():
+        return min(float(value), MAX_BACKOFF * 4)
+
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+
+    seconds = (when - datetime.now(timezone.utc)).total_seconds()
+    return min(max(seconds, 0), MAX_BACKOFF * 4)
+
+
+client = HttpClient()
+
+
+def http_request(url: str):
+    return client.get(url)
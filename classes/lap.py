@@ -1,25 +1,37 @@
-from datetime import datetime
 from termcolor import colored
 
+from classes.laptime import LapTime, ZERO_TIME, compare_times
 from classes.printing import print_side_by_side
 
 
 class Lap:
-    time: str
+    __slots__ = ('time', 'sectors', 'number', 'valid')
+
+    time: LapTime
     sectors: list
     number: int
     valid: bool
 
     def __init__(self, number: int):
-        self.time = ''
+        self.time = ZERO_TIME
         self.sectors = []
         self.number = number
         self.valid = True
 
+    def __setstate__(self, state):
+        # Pickled since __slots__: (None, {slot: value})
+        if isinstance(state, tuple):
+            state = state[1] or {}
+        # Older pickles stored the time as a string
+        for key, value in state.items():
+            setattr(self, key, value)
+        if self.time == '':
+            self.time = ZERO_TIME
+        self.time = LapTime.parse(self.time)
 
     def add_sector(self, sector):
         self.sectors.append(sector)
-        self.time = tally_times(self.sectors)
+        self.time = self.time + sector.time
 
 
     def print(self):
@@ -49,7 +61,7 @@ class Lap:
 
     def json(self):
         output = {
-            'time': self.time,
+            'time': self.time.json(),
             'number': self.number,
             'valid': self.valid,
         }
@@ -81,58 +93,3 @@ class Lap:
         for sector in self.sectors:
             if sector.number == number:
                 return sector
-
-
-def compare_times(time_1: str, time_2: str):
-    """
-    Returns the difference between two times in seconds.
-    Accepts Minutes:Seconds.milliseconds
-    00:35.927
-    """
-
-    t1 = datetime.strptime(time_1, '%M:%S.%f')
-    t2 = datetime.strptime(time_2, '%M:%S.%f')
-
-    diff = t2 - t1
-
-    return diff.total_seconds()
-
-def tally_times(sectors):
-    
-    minutes = 0
-    seconds = 0
-    milliseconds = 0
-
-    for sector in sectors:
-        minutes += int(sector.time[:2])
-        seconds += int(sector.time[3:5])
-        milliseconds += int(sector.time[6:9])
-
-    
-    milliseconds = float(milliseconds / 1000)
-
-    sec = int(str(milliseconds).split('.')[0])
-    seconds += sec
-
-    milliseconds = str(round(float(milliseconds - sec), 3)).split('.')[1]
-
-    
-
-    m, s = divmod(seconds, 60)
-
-
-    seconds = s 
-    minutes += m
-
-    if minutes < 10:
-        minutes = f'0{minutes}'
-    if seconds < 10:
-        seconds = f'0{seconds}'
-
-    if len(str(milliseconds)) == 1:
-        milliseconds = f'{milliseconds}00'
-    elif len(str(milliseconds)) == 2:
-        milliseconds = f'{milliseconds}0'
-    
-
-    return f'{minutes}:{seconds}.{milliseconds}'
\ No newline at end of file
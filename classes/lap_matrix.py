@@ -0,0 +1,138 @@
+from classes.laptime import LapTime, ZERO_TIME
+
+# NumPy is optional.  Without it the same numbers come
+# from the plain Python loops in session.py.
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+PERCENTILES = (10, 25, 50, 75, 90)
+
+
+def available():
+    return np is not None
+
+
+def lap_matrix(laps):
+    """
+    A LapTable as (times, valid, numbers):
+    an n_laps x n_sectors matrix of milliseconds, a boolean mask of
+    valid laps and the lap numbers.  None if there are no laps or
+    the laps don't all have the same number of sectors.
+    """
+
+    if np is None or len(laps) == 0:
+        return None
+
+    counts = np.frombuffer(laps.counts, dtype=np.intc)
+    if counts[0] == 0 or counts.min() != counts.max():
+        return None
+
+    times = np.frombuffer(laps.times, dtype=np.intc).reshape(len(laps), int(counts[0]))
+    valid_bits = np.unpackbits(np.frombuffer(laps.valid, dtype=np.uint8), bitorder='little')
+    valid = valid_bits[:len(laps)].astype(bool)
+    numbers = np.frombuffer(laps.numbers, dtype=np.intc)
+
+    return times, valid, numbers
+
+
+def lap_statistics(laps):
+    """
+    (best, consistency, averages) for a LapTable, the same as
+    session.lap_statistics.  None if lap_matrix can't represent the laps.
+    """
+
+    matrix = lap_matrix(laps)
+    if matrix is None:
+        return None
+
+    times, valid, numbers = matrix
+    headers = [f'Sector {number}' for number in range(1, times.shape[1] + 1)]
+
+    best = {}
+    fast = times[valid]
+    if len(fast) > 0:
+        for header, ms in zip(headers, fast.min(axis=0)):
+            best[header] = LapTime(int(ms))
+        best['total'] = LapTime(int(fast.sum(axis=1, dtype=np.int64).min()))
+
+    # Lap 1 doesn't count towards consistency or the average lap
+    counted = times[valid & (numbers != 1)]
+    consistency = {}
+    averages = {}
+    if len(counted) > 0:
+        spreads = counted.max(axis=0) - counted.min(axis=0)
+        totals = counted.sum(axis=0, dtype=np.int64)
+        for header, spread, total in zip(headers, spreads, totals):
+            consistency[header] = LapTime(int(spread)).total_seconds()
+            averages[header] = LapTime(round(int(total) / len(counted)))
+    else:
+        for header in headers:
+            consistency[header] = 0.0
+            averages[header] = ZERO_TIME
+
+    return best, consistency, averages
+
+
+def sector_stats(times, valid, percentiles=PERCENTILES):
+    """
+    Best, mean, median, spread and percentiles (all in milliseconds)
+    of each sector over the valid rows of a lap matrix
+    """
+
+    fast = times[valid]
+    output = {}
+    if len(fast) == 0:
+        return output
+
+    best = fast.min(axis=0)
+    mean = fast.mean(axis=0)
+    median = np.median(fast, axis=0)
+    spread = fast.max(axis=0) - best
+    points = np.percentile(fast, percentiles, axis=0)
+
+    for column in range(times.shape[1]):
+        output[f'Sector {column + 1}'] = {
+            'best': int(best[column]),
+            'mean': float(mean[column]),
+            'median': float(median[column]),
+            'spread': int(spread[column]),
+            'percentiles': {
+                percentile: float(points[row][column]) for row, percentile in enumerate(percentiles)
+            },
+        }
+
+    return output
+
+
+def field_matrix(results: dict):
+    """
+    Every lap of everyone in a session, from SessionIndex.results().
+    Returns (times, valid, numbers, driver_ids) with one row per lap,
+    or None.  Drivers whose laps don't fit the matrix are left out.
+    """
+
+    if np is None:
+        return None
+
+    parts = []
+    for driver_id, result in results.items():
+        matrix = lap_matrix(result['laps'])
+        if matrix is not None:
+            parts.append((driver_id, matrix))
+
+    if len(parts) == 0:
+        return None
+
+    # Keep the drivers with the most common sector count
+    widths = [matrix[0].shape[1] for _, matrix in parts]
+    width = max(set(widths), key=widths.count)
+    parts = [(driver_id, matrix) for driver_id, matrix in parts if matrix[0].shape[1] == width]
+
+    times = np.vstack([matrix[0] for _, matrix in parts])
+    valid = np.concatenate([matrix[1] for _, matrix in parts])
+    numbers = np.concatenate([matrix[2] for _, matrix in parts])
+    driver_ids = np.concatenate([np.full(len(matrix[2]), driver_id) for driver_id, matrix in parts])
+
+    return times, valid, numbers, driver_ids
@@ -0,0 +1,79 @@
+from array import array
+from itertools import accumulate
+
+from classes.lap import Lap
+from classes.laptime import LapTime
+from classes.sector import Sector
+
+
+class LapTable:
+    """
+    Every lap of a Race in a few flat arrays instead of a Lap and
+    three Sectors per lap:
+
+    numbers  lap number of each lap
+    valid    bitmap, bit i set if lap i is valid
+    counts   number of sectors in each lap
+    times    every sector time in milliseconds, lap after lap
+
+    Indexing or iterating builds Lap objects on the fly, so code that
+    works with a list of Laps keeps working.
+    """
+
+    __slots__ = ('numbers', 'valid', 'counts', 'times', 'offsets')
+
+    def __init__(self, numbers=None, valid: bytes = b'', counts=None, times=None):
+        self.numbers = numbers if numbers is not None else array('i')
+        self.valid = bytes(valid)
+        self.counts = counts if counts is not None else array('i')
+        self.times = times if times is not None else array('i')
+        self.offsets = None
+
+    @classmethod
+    def from_laps(cls, laps: list):
+        numbers = array('i')
+        valid = bytearray((len(laps) + 7) // 8)
+        counts = array('i')
+        times = array('i')
+        for index, lap in enumerate(laps):
+            numbers.append(lap.number)
+            if lap.valid:
+                valid[index // 8] |= 1 << (index % 8)
+            counts.append(len(lap.sectors))
+            for sector in lap.sectors:
+                times.append(sector.time.ms)
+
+        return cls(numbers, valid, counts, times)
+
+    def __len__(self):
+        return len(self.numbers)
+
+    def __iter__(self):
+        position = 0
+        for index in range(len(self.numbers)):
+            yield self.build_lap(index, position)
+            position += self.counts[index]
+
+    def __getitem__(self, index: int):
+        if index < 0:
+            index += len(self.numbers)
+        if not 0 <= index < len(self.numbers):
+            raise IndexError('lap index out of range')
+
+        if self.offsets is None:
+            self.offsets = array('i', accumulate(self.counts, initial=0))
+
+        return self.build_lap(index, self.offsets[index])
+
+    def is_valid(self, index: int):
+        return bool(self.valid[index // 8] & (1 << (index % 8)))
+
+    def build_lap(self, index: int, position: int):
+        lap = Lap(self.numbers[index])
+        if not self.is_valid(index):
+            lap.invalidate()
+        for sector_number in range(1, self.counts[index] + 1):
+            lap.add_sector(Sector(LapTime(self.times[position]), sector_number))
+            position += 1
+
+        return lap
@@ -0,0 +1,161 @@
+class LapTime:
+    """
+    A lap or sector time stored as a whole number of milliseconds.
+    Parses and formats Minutes:Seconds.milliseconds
+    00:35.927
+    """
+
+    __slots__ = ('ms',)
+
+    def __init__(self, ms: int = 0):
+        self.ms = int(ms)
+
+    @classmethod
+    def parse(cls, value):
+        """
+        Build a LapTime from a string, a number of milliseconds
+        or another LapTime.
+        """
+
+        if isinstance(value, LapTime):
+            return value
+        if isinstance(value, int):
+            return cls(value)
+        if not isinstance(value, str):
+            raise TypeError(f'Cannot parse a lap time from {value!r}')
+
+        value = value.strip()
+        whole, _, fraction = value.partition('.')
+        if not whole or not fraction.isdigit():
+            raise ValueError(f'Invalid lap time {value!r}')
+
+        seconds = 0
+        for part in whole.split(':'):
+            if not part.isdigit():
+                raise ValueError(f'Invalid lap time {value!r}')
+            seconds = seconds * 60 + int(part)
+
+        milliseconds = int(f'{fraction}00'[:3])
+
+        return cls(seconds * 1000 + milliseconds)
+
+    def total_seconds(self):
+        return self.ms / 1000
+
+    def json(self):
+        return str(self)
+
+    def __str__(self):
+        minutes, milliseconds = divmod(self.ms, 60000)
+        seconds, milliseconds = divmod(milliseconds, 1000)
+        return f'{minutes:02d}:{seconds:02d}.{milliseconds:03d}'
+
+    def __repr__(self):
+        return f"LapTime('{self}')"
+
+    def __format__(self, format_spec):
+        return format(str(self), format_spec)
+
+    def __hash__(self):
+        return hash(self.ms)
+
+    def __eq__(self, other):
+        if isinstance(other, LapTime):
+            return self.ms == other.ms
+        return NotImplemented
+
+    def __lt__(self, other):
+        if isinstance(other, LapTime):
+            return self.ms < other.ms
+        return NotImplemented
+
+    def __le__(self, other):
+        if isinstance(other, LapTime):
+            return self.ms <= other.ms
+        return NotImplemented
+
+    def __gt__(self, other):
+        if isinstance(other, LapTime):
+            return self.ms > other.ms
+        return NotImplemented
+
+    def __ge__(self, other):
+        if isinstance(other, LapTime):
+            return self.ms >= other.ms
+        return NotImplemented
+
+    def __add__(self, other):
+        if isinstance(other, LapTime):
+            return LapTime(self.ms + other.ms)
+        return NotImplemented
+
+    def __radd__(self, other):
+        # Lets sum() start from the integer 0
+        if other == 0:
+            return self
+        return NotImplemented
+
+    def __sub__(self, other):
+        if isinstance(other, LapTime):
+            return LapTime(self.ms - other.ms)
+        return NotImplemented
+
+    def __truediv__(self, count: int):
+        return LapTime(round(self.ms / count))
+
+    def __reduce__(self):
+        return (LapTime, (self.ms,))
+
+
+ZERO_TIME = LapTime(0)
+
+# Placeholder "best" that any real lap will beat
+SLOWEST_TIME = LapTime.parse('10:59.999')
+
+
+def compare_times(time_1, time_2):
+    """
+    Returns the difference between two times in seconds.
+    Accepts LapTimes or Minutes:Seconds.milliseconds
+    00:35.927
+    """
+
+    return (LapTime.parse(time_2).ms - LapTime.parse(time_1).ms) / 1000
+
+
+def tally_times(sectors):
+    """
+    Total time of a list of sectors
+    """
+
+    return sum((sector.time for sector in sectors), ZERO_TIME)
+
+
+def average_time(time_list: list):
+    """
+    Average of a list of times
+    """
+
+    if len(time_list) == 0:
+        return ZERO_TIME
+
+    total = sum(LapTime.parse(t).ms for t in time_list)
+    return LapTime(round(total / len(time_list)))
+
+
+def min_max(time_list: list):
+    """
+    Return min and max times
+    """
+
+    if len(time_list) == 0:
+        return {
+            'min': ZERO_TIME,
+            'max': ZERO_TIME
+        }
+
+    times = [LapTime.parse(t) for t in time_list]
+    return {
+        'min': min(times),
+        'max': max(times)
+    }
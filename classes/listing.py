@@ -0,0 +1,97 @@
+import json
+import threading
+from os import makedirs, path, remove, replace
+
+LISTING_DIR = './json/listings/'
+
+
+def listing_file(driver_id: int, directory: str = LISTING_DIR):
+    return f'{directory}{driver_id}.json'
+
+
+def mark_file(driver_id: int, directory: str = LISTING_DIR):
+    return f'{directory}{driver_id}.mark.json'
+
+
+def load_high_water_mark(driver_id: int, directory: str = LISTING_DIR):
+    """
+    {'race_id', 'race_date'} of the newest saved row, or None.
+    Kept in its own small file so a sync that finds nothing
+    new doesn't have to read the whole listing.
+    """
+
+    file_name = mark_file(driver_id, directory)
+    if not path.exists(file_name):
+        return None
+
+    with open(file_name) as json_file:
+        return json.load(json_file)
+
+
+def reached_mark(row: dict, mark: dict):
+    """
+    Is the row the mark, or older than it?  The API lists newest
+    first, so every row after this one is already saved.
+    """
+
+    if mark is None:
+        return False
+
+    return row['race_id'] == mark['race_id'] or row['race_date'] < mark['race_date']
+
+
+def listing_order(row: dict):
+    return (row['race_date'], row['race_id'])
+
+
+def load_listing(driver_id: int, directory: str = LISTING_DIR):
+    """
+    The users/getUsersPastRaces rows saved for a driver, newest first,
+    or None if nothing has been saved
+    """
+
+    file_name = listing_file(driver_id, directory)
+    if not path.exists(file_name):
+        return None
+
+    with open(file_name) as json_file:
+        return json.load(json_file)
+
+
+def save_listing(driver_id: int, rows: list, directory: str = LISTING_DIR):
+    """
+    Add rows to the saved listing.  A row for a race_id that's
+    already saved replaces it.  Returns the whole listing.
+    """
+
+    merged = {row['race_id']: row for row in load_listing(driver_id, directory) or []}
+    for row in rows:
+        merged[row['race_id']] = row
+    listing = sorted(merged.values(), key=listing_order, reverse=True)
+
+    if not path.exists(directory):
+        makedirs(directory, exist_ok=True)
+    write_json(listing_file(driver_id, directory), listing)
+
+    # The mark goes last, so it never points past the saved rows
+    if listing:
+        newest = listing[0]
+        write_json(
+            mark_file(driver_id, directory),
+            {'race_id': newest['race_id'], 'race_date': newest['race_date']}
+        )
+
+    return listing
+
+
+def delete_listing(driver_id: int, directory: str = LISTING_DIR):
+    for file_name in (mark_file(driver_id, directory), listing_file(driver_id, directory)):
+        if path.exists(file_name):
+            remove(file_name)
+
+
+def write_json(file_name: str, data):
+    temp_file = f'{file_name}.{threading.get_ident()}.tmp'
+    with open(temp_file, 'w') as out_file:
+        json.dump(data, out_file)
+    replace(temp_file, file_name)
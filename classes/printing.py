@@ -2,6 +2,7 @@ import colorama
 import re
 import sys
 import textwrap
+import threading
 from termcolor import colored as col
 from os import get_terminal_size
 
@@ -38,6 +39,44 @@ def replace_print(msg: str):
     sys.stdout.flush()
 
 
+class QuietableOutput:
+    """
+    Stands in for sys.stdout.  Writes from threads that called
+    quiet_thread() are dropped, so background work doesn't
+    print over the prompt.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+
+    def write(self, text: str):
+        if getattr(self.local, 'quiet', False):
+            return len(text)
+        return self.stream.write(text)
+
+    def flush(self):
+        if not getattr(self.local, 'quiet', False):
+            self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+output_lock = threading.Lock()
+
+
+def quiet_thread():
+    """
+    Stop printing anything from the current thread
+    """
+
+    with output_lock:
+        if not isinstance(sys.stdout, QuietableOutput):
+            sys.stdout = QuietableOutput(sys.stdout)
+        sys.stdout.local.quiet = True
+
+
 
 
 
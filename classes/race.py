@@ -1,14 +1,11 @@
-import requests
-import json
-import time
-from classes.printing import COLOR_CYAN, print_side_by_side, replace_print
+from classes.printing import print_side_by_side
 
-from classes.sector import Sector
-from classes.lap import Lap
+from classes.laptime import LapTime, compare_times
+from classes.lap_table import LapTable
+from classes import lap_matrix
+from classes.session import session_store, parse_best_lap
 
-from datetime import datetime
 from termcolor import colored
-from os import path
 
 # PRETTY
 COLOR_RED = 'red'
@@ -24,16 +21,26 @@ PROMPT_ARROW = colored(' ->> ', COLOR_PROMPT)
 # colorama.init()
 # / PRETTY
 
-BASE_URL = 'https://api2.lowfuelmotorsport.com/api/'
+class Race:
+    """
+    One driver's view of a session.  Things every participant shares
+    (chat, the opponent list, everyone else's laps) live in the
+    session store and are not saved with the Race.
+    """
 
-SESSION_CACHE_DIR = './json/session_cache/'
+    __slots__ = (
+        'session_id', 'track', 'date', 'epoch', 'laps', 'weather', 'split', 'car_class',
+        'car_name', 'car_year', 'start_position', 'finish_position', 'incidents',
+        'mandatory_pitstops', 'best_lap', 'total_time', 'dnf', 'dns', 'gap', 'best', 'url',
+        'analysis', 'event_id', 'driver_elo', 'driver_safety_rating', 'valid_laps',
+        'valid_lap_percentage', 'invalid_laps', 'invalid_lap_percentage', 'countable_laps'
+    )
 
-class Race:
     session_id: int
     track: str
     date: str
     epoch: int
-    laps: list
+    laps: LapTable
     weather: dict
     split: int
     car_class: str
@@ -43,14 +50,12 @@ class Race:
     finish_position: int
     incidents: int
     mandatory_pitstops: int
-    chat: list
-    best_lap: str
+    best_lap: LapTime
     total_time: str
     dnf: bool
     dns: bool
     gap: str
     best: dict
-    opponents: list
     url: str
     analysis: dict
     event_id: int
@@ -67,31 +72,24 @@ class Race:
         self.start_position = 0
         self.finish_position = 0
         self.split = None
-        self.opponents = []
 
         self.session_id = session_id
 
-        data = gather_data(session_id)
-
-        self.track = data['track']['track_name']
-        self.date = data['race_date']
-        self.epoch = date_to_epoch(self.date)
-        self.weather = {
-                'ambient': data['server_settings']['server_settings']['event']['data']['ambientTemp'],
-                'clouds': data['server_settings']['server_settings']['event']['data']['cloudLevel'],
-                'rain': data['server_settings']['server_settings']['event']['data']['rain'],
-                'randomness': data['server_settings']['server_settings']['event']['data']['weatherRandomness']
-            }
-        self.event_id = data['event_id']
-        self.url = f'https://lowfuelmotorsport.com/events/{self.event_id}/race/{self.session_id}'
-        self.mandatory_pitstops = data['event']['settings']['season_event_settings']['default_server_settings']['pitstop_mandatory']
-        self.chat = data['chat']
+        session = session_store.get(session_id)
+
+        self.track = session.track
+        self.date = session.date
+        self.epoch = session.epoch
+        self.weather = session.weather
+        self.event_id = session.event_id
+        self.url = session.url
+        self.mandatory_pitstops = session.mandatory_pitstops
 
         self.laps = []
 
         self.best = {}
 
-        extracted = extract_laps(data, driver_id)
+        extracted = session.driver_results(driver_id)
 
         self.laps = extracted['laps']
         self.best = extracted['best']
@@ -111,10 +109,10 @@ class Race:
         
         self.invalid_laps = 0
         self.valid_laps = 0
-        for lap in self.laps:
+        for index, number in enumerate(self.laps.numbers):
             # Don't count the first lap.  Sometimes the game says it's invalid for no reason.... also says the lap takes ____ minutes.
-            if lap.number != 1:
-                if not lap.valid:
+            if number != 1:
+                if not self.laps.is_valid(index):
                     self.invalid_laps += 1
                 else:
                     self.valid_laps += 1
@@ -155,9 +153,29 @@ class Race:
         if self.split == None:
             self.split = -1
 
-        self.opponents = extract_opponent_list(data, self.split)
-
-
+    def __setstate__(self, state):
+        # Pickled since __slots__: (None, {slot: value})
+        if isinstance(state, tuple):
+            state = state[1] or {}
+        # Older pickles stored every time as a string,
+        # and kept their own copy of the chat and opponents
+        # and a Lap object for every lap
+        state.pop('chat', None)
+        state.pop('opponents', None)
+        for key, value in state.items():
+            setattr(self, key, value)
+        self.best = {key: LapTime.parse(value) for key, value in self.best.items()}
+        self.best_lap = parse_best_lap(self.best_lap)
+        if type(self.laps) == list:
+            self.laps = LapTable.from_laps(self.laps)
+
+    @property
+    def chat(self):
+        return session_store.get(self.session_id).chat
+
+    @property
+    def opponents(self):
+        return session_store.get(self.session_id).opponents(self.split)
 
     def json(self):
         output = {
@@ -173,7 +191,7 @@ class Race:
             'finish_position': self.finish_position,
             'incidents': self.incidents,
             'mandatory_pitstops': self.mandatory_pitstops,
-            'best_lap': self.best_lap,
+            'best_lap': self.best_lap.json() if self.best_lap else None,
             'total_time': self.total_time,
             'dnf': self.dnf,
             'dns': self.dns,
@@ -254,9 +272,9 @@ class Race:
             for sector_number in range(1, 4):
                 sector_header = f'Sector {sector_number}'
                 sector = lap.return_sector(sector_number)
-                temp = f'{temp}{sector_header}: {colored(sector.time, pretty_time(sector.time, self.best[f"{sector_header}"], lap.valid))}\n'
+                temp = f'{temp}{sector_header}: {colored(str(sector.time), pretty_time(sector.time, self.best[f"{sector_header}"], lap.valid))}\n'
             
-            temp = f'{temp}Total: {colored(lap.time, pretty_time(lap.time, self.best["total"], lap.valid))}\n' 
+            temp = f'{temp}Total: {colored(str(lap.time), pretty_time(lap.time, self.best["total"], lap.valid))}\n' 
 
             output.append(temp)
 
@@ -279,6 +297,52 @@ class Race:
 
 
 
+    def sector_stats(self):
+        """
+        lap_matrix.sector_stats for this driver's laps and for every
+        lap in the session, as {'driver': ..., 'field': ...}.
+        Lap 1 doesn't count, as with the average lap.
+        None without NumPy.
+        """
+
+        if not lap_matrix.available():
+            return None
+
+        output = {'driver': {}, 'field': {}}
+        mine = lap_matrix.lap_matrix(self.laps)
+        if mine is not None:
+            times, valid, numbers = mine
+            output['driver'] = lap_matrix.sector_stats(times, valid & (numbers != 1))
+
+        field = lap_matrix.field_matrix(session_store.get(self.session_id).index.results())
+        if field is not None:
+            times, valid, numbers, _ = field
+            output['field'] = lap_matrix.sector_stats(times, valid & (numbers != 1))
+
+        return output
+
+    def print_sector_stats(self):
+        stats = self.sector_stats()
+        if stats is None:
+            print('Sector statistics need NumPy (pip install numpy)')
+            return
+
+        output = []
+        for header, field in stats['field'].items():
+            mine = stats['driver'].get(header)
+            text = f'{header}\n{"":8}{"You":>10}{"Field":>10}\n'
+            for label, key in (('Best', 'best'), ('Mean', 'mean'), ('Median', 'median'), ('Spread', 'spread')):
+                text = f'{text}{label:8}{stat_text(mine, key):>10}{stat_text(field, key):>10}\n'
+            for percentile in field['percentiles']:
+                text = f'{text}{"P" + str(percentile):8}{stat_text(mine, "percentiles", percentile):>10}{stat_text(field, "percentiles", percentile):>10}\n'
+            output.append(text)
+
+        if len(output) == 0:
+            print('No valid laps in this session')
+            return
+
+        print_side_by_side(output, 3, 30)
+
     def show_opponents(self):
         messages = []
         for opponent in self.opponents:
@@ -294,10 +358,8 @@ class Race:
         Compare my race to this opponent
         """
 
-        race_data = gather_data(self.session_id)
-
         opponent = return_opponent(self.opponents, opponent_id)
-        opponent_lap_data = extract_laps(race_data, opponent_id)
+        opponent_lap_data = session_store.get(self.session_id).driver_results(opponent_id)
 
 
         print('')
@@ -352,14 +414,14 @@ class Race:
                     driver_sector_color = "white"
                     opponent_sector_color = "green"
                 else:
-                    driver_sector_time = driver_lap.return_sector(sector_number).time
+                    driver_sector_time = str(driver_lap.return_sector(sector_number).time)
 
                 if opponent_lap == None:
                     opponent_sector_time = 'N/A'
                     opponent_sector_color = "white"
                 else:
-                    opponent_sector_time = opponent_lap.return_sector(sector_number).time
-                    if driver_sector_time != "N\A":
+                    opponent_sector_time = str(opponent_lap.return_sector(sector_number).time)
+                    if driver_sector_time != "N/A":
                         if compare_times(driver_sector_time, opponent_sector_time) < 0:
                             driver_sector_color = "white"
                             opponent_sector_color = "green"
@@ -375,7 +437,7 @@ class Race:
                 driver_lap_color = "white"
                 opponent_lap_color = "green"
             else:
-                driver_lap_time = driver_lap.time
+                driver_lap_time = str(driver_lap.time)
                 driver_lap_color = "green"
                 opponent_lap_color = "white"
 
@@ -383,7 +445,7 @@ class Race:
                 opponent_lap_time = "N\A"
                 opponent_lap_color = "white"
             else:
-                opponent_lap_time = opponent_lap.time
+                opponent_lap_time = str(opponent_lap.time)
                 if driver_lap_time != 'N\A':
                     if compare_times(driver_lap_time, opponent_lap_time) < 0:
                         driver_lap_color = "white"
@@ -415,216 +477,24 @@ def return_opponent(opponent_list, opponent_id):
 
     return None
 
-def extract_opponent_list(data: dict, split: int):
-    opponents = []
-    for data_split in data['race_results_splits']:
-        if type(data_split) == dict:
-            for xcar_class in data_split:
-                results = data_split[xcar_class]['OVERALL']
-                for result in results:
-                    if result['split'] == split:
-                        driver_id = result['driver_id']
-                        driver_name = f"{result['vorname']} {result['nachname']}"
-                        opponents.append(
-                            {
-                                'name': driver_name, 
-                                'id': driver_id,
-                                'finish': result['position'],
-                                'fastest': result['bestlap'],
-                                'car': f"{result['year']} {result['car_name']}",
-                                'dns': bool(result['dns']),
-                                'dnf': bool(result['dnf'])
-                                }
-                        )
-    
-    return opponents
-
-
-def extract_laps(data: dict, driver_id: int):
-
-    best = {}
-    analysis = {}
-    laps = []
-
-
-    sector_analysis = {}
-    split = None
-    best_lap = None
-    car_class = None
-    car_name = None
-    car_year = None
-    total_time = None
-    dnf = None
-    dns = None
-    gap = None
-    incidents = 0
-    name = None
-    elo = None
-    sr = None
-
-
-
-    for data_split in data['race_results_splits']:
-        if type(data_split) == dict:
-            for xcar_class in data_split:
-                results = data_split[xcar_class]['OVERALL']
-                for result in results:
-                    if result['driver_id'] == driver_id:
-                        sr = result['safety_rating']
-                        elo = result['rating']
-                        if result['ratingGain'] != None:
-                            elo += result['ratingGain']
-                        data_laps = result['lapDetail']
-
-                        laps_added = []
-                        for data_lap in data_laps:
-                            
-                            lap_number = data_lap['car_lap']
-                            if lap_number not in laps_added:
-                                laps_added.append(lap_number)
-                                lap = Lap(lap_number)
-                                if data_lap['lap_valid'] == 0:
-                                    lap.invalidate()
-
-                                sector_counter = 1
-                                for data_sector in data_lap['splits']:
-                                    sector_header = f'Sector {sector_counter}'
-                                    if sector_header not in sector_analysis:
-                                        sector_analysis[sector_header] = []
-                                    if lap.valid:
-                                        if lap.number != 1:
-                                            try:
-                                                sector_analysis[sector_header].append(data_sector)
-                                            except:
-                                                print('')
-                                                print(f'Problem in lap {lap.number}, {sector_header}\n\n')
-                                        if sector_header not in best:
-                                            best[sector_header] = data_sector
-
-                                        else:
-                                            compared = compare_times(best[sector_header], data_sector)
-                                            if compared < 0:
-                                                best[sector_header] = data_sector
-
-                                    sector = Sector(data_sector, sector_counter)
-                                    sector_counter += 1
-                                    lap.add_sector(sector)
-
-                                
-                                if lap.valid:
-                                    if 'total' not in best:
-                                        best['total'] = lap.time
-                                    else:
-                                        compared = compare_times(best['total'], lap.time)
-                                        if compared < 0:
-                                            best['total'] = lap.time
-
-                                laps.append(lap)
-
-
-                        hypothetical_lap = Lap(-1)
-                        for xbest in best:
-                            if 'Sector' in xbest:
-                                hypothetical_lap.add_sector(
-                                    Sector(
-                                        best[xbest], 
-                                        int(xbest.replace('Sector ', ''))
-                                        )
-                                    )
-                        analysis['hypothetical'] = hypothetical_lap
-
-                        analysis['consistency'] = {}
-
-                        for key in sector_analysis:
-                            minmax = min_max(sector_analysis[key])
-                            analysis['consistency'][key] = abs(compare_times(minmax['min'], minmax['max']))
-                            sector_analysis[key] = average_time(sector_analysis[key])
-
-
-                        average_lap = Lap(-2)
-                        for sector_number in range(1, 4):
-                            sector_key = f'Sector {sector_number}'
-                            if sector_key in sector_analysis:
-                                avg_sector = Sector(sector_analysis[sector_key], sector_number)
-                                average_lap.add_sector(avg_sector)
-
-
-                        analysis['average'] = average_lap
-
-                        best_lap = result['bestlap']
-                        split = result['split']
-                        car_class = result['class']
-                        car_name = result['car_name']
-                        car_year = result['year']
-                        total_time = result['time']
-                        dnf = bool(result['dnf'])
-                        dns = bool(result['dns'])
-                        gap = result['gap']
-                        incidents = result['incidents']
-                        name = f"{result['vorname']} {result['nachname']}"
-                        break
-
-    if not split:
-        split = -1
-    return {
-        'best': best,
-        'laps': laps,
-        'best_lap': best_lap,
-        'split': split,
-        'car_class': car_class,
-        'car_name': car_name,
-        'car_year': car_year,
-        'total_time': total_time,
-        'dnf': dnf,
-        'gap': gap,
-        'dns': dns,
-        'incidents': incidents,
-        'name': name,
-        'analysis': analysis,
-        'elo': elo,
-        'safety_rating': sr
-    }
-
-
-
-def average_time(time_list: list):
-
-    if len(time_list) == 0:
-        return '00:00.000'
-
-    minutes = 0
-    seconds = 0
-    milliseconds = 0
-
-    for t in time_list:
-        minutes += int(t[:2])
-        seconds += int(t[3:5])
-        milliseconds += int(t[6:9])
-
-    milliseconds = float(milliseconds / 1000)
-
-    total_seconds = seconds + (minutes * 60) + milliseconds
-    
-    m, s = divmod(total_seconds / len(time_list), 60)
-
-    m = int(m)
-    if m < 10:
-        m = f'0{m}'
-    s = round(s, 3)
-    if s < 10:
-        s = f'0{s}'
-
-    new_milliseconds = str(s).split('.')[1]
-    if len(new_milliseconds) == 1:
-        s = f'{s}00'
-    elif len(new_milliseconds) == 2:
-        s = f'{s}0'
-
-    return f'{m}:{s}'
-        
 def percentage(part, whole):
     return (round(100 * float(part)/float(whole), 1))
 
+def stat_text(stats: dict, key: str, percentile: int = None):
+    """
+    One value from lap_matrix.sector_stats as a time, '-' if missing
+    """
+
+    if not stats:
+        return '-'
+
+    value = stats[key] if percentile is None else stats[key][percentile]
+    if key == 'spread':
+        return f'+/- {LapTime(value).total_seconds()}'
+
+    return str(LapTime(round(value)))
+
+
 def pretty_time(time_value, best_value, valid_lap=True):
     """
     Figure out what color time_value should be when printed
@@ -640,12 +510,12 @@ def pretty_time(time_value, best_value, valid_lap=True):
     if valid_lap == False:
         return COLOR_WHITE
 
-    comparison = compare_times(best_value, time_value)
+    comparison = LapTime.parse(time_value).ms - LapTime.parse(best_value).ms
 
-    if comparison > 1:
+    if comparison > 1000:
         return COLOR_RED
 
-    elif comparison > .5:
+    elif comparison > 500:
 
         return COLOR_YELLOW
 
@@ -655,127 +525,6 @@ def pretty_time(time_value, best_value, valid_lap=True):
     else:
        return COLOR_PURPLE
 
-def gather_data(session_id: int):
-    replace_print(f'gathering session {session_id}  ')
-    cache = load_cache(session_id)
-    if cache:
-        return cache
-
-    url = f'{BASE_URL}race/{session_id}'
-
-    request = http_request(url)
-    data = request.json()
-    save_cache(session_id, data)
-
-    return data
-
-def http_request(url: str):
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/70.0.3538.77 Safari/537.36"
-        }
-    
-    attempts = 0
-    while True:
-        try:
-            attempts += 1
-            req = requests.get(url, headers=headers)
-            if req.ok:
-                return req
-        except:
-            time.sleep(attempts * 0.5)
-
-        if attempts > 5:
-            print(colored(f'    ... problems with http requests on {url}', 'red'))
-            print('')
-
-
-def compare_times(time_1: str, time_2: str):
-    """
-    Returns the difference between two times in seconds.
-    Accepts Minutes:Seconds.milliseconds
-    00:35.927
-    """
-
-    t1 = datetime.strptime(time_1, '%M:%S.%f')
-    t2 = datetime.strptime(time_2, '%M:%S.%f')
-
-    diff = t2 - t1
-
-    return diff.total_seconds()
-
-def date_to_epoch(date_string: str):
-    # "2021-08-28 00:15:00"
-    dt = datetime.strptime(date_string, '%Y-%m-%d %H:%M:%S')
-    epoch = dt.timestamp()
-    return int(epoch)
-
-def min_max(time_list: list): 
-    """
-    Return min and max times
-    """
-
-    if len(time_list) == 0:
-        return {
-            'min': '00:00.000',
-            'max': '00:00.000'
-        }
-
-    times = []
-    for time in time_list:
-        times.append(
-            {
-                'time': time,
-                'epoch': float(datetime.strptime(f'2000 {time}', '%Y %M:%S.%f').timestamp())
-            }
-        )
-
-    times = sort_array_of_dicts(times, 'epoch')
-    return {
-        'min': times[-1]['time'],
-        'max': times[0]['time']
-    }
-
-def json_from_file(file_name):
-    with open(file_name) as json_file:
-        json_data = json.load(json_file)
-    return json_data
-    
-    
-    
-def json_to_file(file_name, json_data):
-    with open(file_name, 'w') as out_file:
-        json.dump(json_data, out_file)
-
-
-
-def load_cache(session_id):
-    file_name = f'{SESSION_CACHE_DIR}{session_id}.json'
-    if not path.exists(file_name):
-        return None
-
-    return json_from_file(file_name)
-
-
-def save_cache(session_id, data):
-    file_name = f'{SESSION_CACHE_DIR}{session_id}.json'
-
-    # trim the data
-    remove_keys = [
-        'broadcaster',
-        'entrylist',
-        'participants',
-        'splits',
-        'race_results',
-        'quali_results',
-        'quali_results_splits'
-    ]
-
-    for key in remove_keys:
-        data.pop(key, None)
-
-    json_to_file(file_name, data)
-
-
 def sort_array_of_dicts(array: list, field: str, reverse: bool = True):
     """
     Take an array of dicts and sort the array based on a key:value present in the dicts
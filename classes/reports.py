@@ -0,0 +1,56 @@
+import threading
+from collections import OrderedDict
+
+# Reports kept for the current data version
+REPORT_CACHE_SIZE = 64
+
+
+class ReportCache:
+    """
+    The data behind the slow report commands (uncolored, so the
+    same result can be printed with different highlighting), keyed by
+    command, arguments and data version.
+
+    Anything that changes what a report would show calls bump(),
+    after which every report is built again the next time it's asked for.
+    """
+
+    def __init__(self, max_entries: int = REPORT_CACHE_SIZE):
+        self.version = 0
+        self.entries = OrderedDict()
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def bump(self):
+        with self.lock:
+            self.version += 1
+            self.entries.clear()
+
+    def get(self, command: str, arguments: tuple, build):
+        """
+        The cached result of build() for these arguments,
+        calling it if there isn't one for the current version
+        """
+
+        with self.lock:
+            key = (command, arguments, self.version)
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+
+        report = build()
+        with self.lock:
+            # Don't keep a report if the data changed while it was built
+            if key[2] == self.version:
+                self.entries[key] = report
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+
+        return report
+
+
+report_cache = ReportCache()
@@ -0,0 +1,83 @@
+import heapq
+import itertools
+import threading
+import time
+
+# Request budget shared by every API call in the process
+REQUESTS_PER_SECOND = 4.0
+BURST = 4
+
+# Lower numbers are served first when requests are queued.
+# The leaderboards are asked for interactively, so they jump the queue.
+ENDPOINT_PRIORITIES = [
+    ('statistics/', 0),
+    ('users/getUsersPastRaces/', 1),
+    ('race/', 2),
+]
+DEFAULT_PRIORITY = 1
+
+
+def endpoint_priority(url: str):
+    for fragment, priority in ENDPOINT_PRIORITIES:
+        if fragment in url:
+            return priority
+
+    return DEFAULT_PRIORITY
+
+
+class RequestScheduler:
+    """
+    Token bucket shared by every thread.  Callers queue up by priority
+    (then arrival order) and are released as tokens become available.
+    """
+
+    def __init__(self, rate: float = REQUESTS_PER_SECOND, burst: int = BURST):
+        self.condition = threading.Condition()
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.waiting = []
+        self.counter = itertools.count()
+
+    def set_rate(self, rate: float, burst: int = None):
+        with self.condition:
+            self.refill()
+            self.rate = rate
+            if burst is not None:
+                self.burst = burst
+                self.tokens = min(self.tokens, burst)
+            self.condition.notify_all()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, priority: int = DEFAULT_PRIORITY):
+        """
+        Block until this caller may send one request
+        """
+
+        with self.condition:
+            ticket = (priority, next(self.counter))
+            heapq.heappush(self.waiting, ticket)
+
+            while True:
+                self.refill()
+                if self.waiting[0] == ticket:
+                    if self.tokens >= 1:
+                        heapq.heappop(self.waiting)
+                        self.tokens -= 1
+                        self.condition.notify_all()
+                        return
+
+                    self.condition.wait((1 - self.tokens) / self.rate)
+                else:
+                    self.condition.wait()
+
+    def wait_for(self, url: str):
+        self.acquire(endpoint_priority(url))
+
+
+scheduler = RequestScheduler()
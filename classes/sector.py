@@ -1,12 +1,25 @@
+from classes.laptime import LapTime
+
 
 class Sector:
-    time: str
+    __slots__ = ('time', 'number')
+
+    time: LapTime
     number: int
 
-    def __init__(self, time: str, number: int):
-        self.time = time
+    def __init__(self, time, number: int):
+        self.time = LapTime.parse(time)
         self.number = number
 
+    def __setstate__(self, state):
+        # Pickled since __slots__: (None, {slot: value})
+        if isinstance(state, tuple):
+            state = state[1] or {}
+        # Older pickles stored the time as a string
+        for key, value in state.items():
+            setattr(self, key, value)
+        self.time = LapTime.parse(self.time)
+
     def print(self):
         print(
             self.text()
@@ -20,6 +33,6 @@ class Sector:
 
     def json(self):
         return {
-            'time': self.time,
+            'time': self.time.json(),
             'number': self.number
-        }
\ No newline at end of file
+        }
@@ -0,0 +1,436 @@
+import threading
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from classes.http_client import http_request
+from classes.printing import replace_print
+from classes.sector import Sector
+from classes.lap import Lap
+from classes.lap_table import LapTable
+from classes import lap_matrix
+from classes.laptime import LapTime, average_time, min_max
+from classes.session_cache import session_cache
+
+from datetime import datetime
+
+BASE_URL = 'https://api2.lowfuelmotorsport.com/api/'
+
+# Concurrent session downloads.  The request scheduler keeps
+# the overall rate polite no matter how many workers there are.
+FETCH_WORKERS = 4
+
+# How much memory parsed sessions may take before the least
+# recently used are dropped.  Sizes are estimated from the number
+# of result rows, laps and chat messages in each session.
+STORE_BUDGET = 256 * 1024 ** 2
+ROW_BYTES = 4000
+LAP_BYTES = 1500
+MESSAGE_BYTES = 500
+
+
+class Session:
+    """
+    Everything about a race/{id} payload that is the same for each
+    driver in it.  Parsed once and shared by every Race that points here.
+    """
+
+    session_id: int
+    track: str
+    date: str
+    epoch: int
+    weather: dict
+    event_id: int
+    url: str
+    mandatory_pitstops: int
+    chat: list
+
+    def __init__(self, session_id: int, data: dict):
+        self.session_id = session_id
+        self.track = data['track']['track_name']
+        self.date = data['race_date']
+        self.epoch = date_to_epoch(self.date)
+        self.weather = {
+                'ambient': data['server_settings']['server_settings']['event']['data']['ambientTemp'],
+                'clouds': data['server_settings']['server_settings']['event']['data']['cloudLevel'],
+                'rain': data['server_settings']['server_settings']['event']['data']['rain'],
+                'randomness': data['server_settings']['server_settings']['event']['data']['weatherRandomness']
+            }
+        self.event_id = data['event_id']
+        self.url = f'https://lowfuelmotorsport.com/events/{self.event_id}/race/{self.session_id}'
+        self.mandatory_pitstops = data['event']['settings']['season_event_settings']['default_server_settings']['pitstop_mandatory']
+        self.chat = data['chat']
+
+        self.index = SessionIndex(data)
+        self.weight = self.index.weight + MESSAGE_BYTES * sum(
+            len(chats) if type(chats) == list else 1 for chats in self.chat or []
+        )
+
+    def driver_results(self, driver_id: int):
+        """
+        Laps, bests and analysis for one participant (see parse_result)
+        """
+
+        return self.index.result(driver_id)
+
+    def opponents(self, split: int):
+        """
+        Everyone who raced in a split
+        """
+
+        return self.index.opponent_list(split)
+
+
+class SessionStore:
+    """
+    Parsed sessions by session id, most recently used last.
+    Once their estimated size passes budget bytes the least
+    recently used are dropped (and parsed again if asked for).
+    """
+
+    def __init__(self, budget: int = STORE_BUDGET):
+        self.sessions = OrderedDict()
+        self.budget = budget
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, session_id: int):
+        with self.lock:
+            session = self.sessions.get(session_id)
+            if session:
+                self.sessions.move_to_end(session_id)
+                self.hits += 1
+                return session
+            self.misses += 1
+
+        session = Session(session_id, gather_data(session_id))
+        with self.lock:
+            if session_id in self.sessions:
+                return self.sessions[session_id]
+
+            self.sessions[session_id] = session
+            self.size += session.weight
+            # Never drop the session we were just asked for
+            while self.size > self.budget and len(self.sessions) > 1:
+                _, evicted = self.sessions.popitem(last=False)
+                self.size -= evicted.weight
+                self.evictions += 1
+
+        return session
+
+    def stats(self):
+        with self.lock:
+            return {
+                'sessions': len(self.sessions),
+                'size': self.size,
+                'budget': self.budget,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+session_store = SessionStore()
+
+
+class SessionIndex:
+    """
+    Every result row in a session, found with one pass over
+    race_results_splits.  Rows are turned into laps and analysis
+    the first time somebody asks for them.
+    """
+
+    rows: dict
+    opponents: dict
+    parsed: dict
+    weight: int         # rough size in memory, for SessionStore
+
+    def __init__(self, data: dict):
+        self.rows = {}
+        self.opponents = {}
+        self.parsed = {}
+        self.weight = 0
+
+        for data_split in data['race_results_splits']:
+            if type(data_split) == dict:
+                for xcar_class in data_split:
+                    results = data_split[xcar_class]['OVERALL']
+                    for result in results:
+                        driver_id = result['driver_id']
+                        if driver_id in self.rows:
+                            continue
+
+                        self.rows[driver_id] = result
+                        self.weight += ROW_BYTES + LAP_BYTES * len(result['lapDetail'] or [])
+                        if result['split'] not in self.opponents:
+                            self.opponents[result['split']] = []
+                        self.opponents[result['split']].append(opponent_entry(result))
+
+    def result(self, driver_id: int):
+        """
+        Parsed result for one driver (see parse_result)
+        """
+
+        if driver_id not in self.parsed:
+            row = self.rows.get(driver_id)
+            if row is None:
+                self.parsed[driver_id] = empty_result()
+            else:
+                self.parsed[driver_id] = parse_result(row)
+
+        return self.parsed[driver_id]
+
+    def results(self):
+        """
+        Parsed results for the whole field
+        """
+
+        return {driver_id: self.result(driver_id) for driver_id in self.rows}
+
+    def opponent_list(self, split: int):
+        return self.opponents.get(split, [])
+
+
+def opponent_entry(result: dict):
+    return {
+        'name': f"{result['vorname']} {result['nachname']}",
+        'id': result['driver_id'],
+        'finish': result['position'],
+        'fastest': result['bestlap'],
+        'car': f"{result['year']} {result['car_name']}",
+        'dns': bool(result['dns']),
+        'dnf': bool(result['dnf'])
+    }
+
+
+def empty_result():
+    """
+    What parse_result reports for a driver who isn't in the session
+    """
+
+    return {
+        'best': {},
+        'laps': LapTable(),
+        'best_lap': None,
+        'split': -1,
+        'car_class': None,
+        'car_name': None,
+        'car_year': None,
+        'total_time': None,
+        'dnf': None,
+        'gap': None,
+        'dns': None,
+        'incidents': 0,
+        'name': None,
+        'analysis': {},
+        'elo': None,
+        'safety_rating': None
+    }
+
+
+def parse_result(result: dict):
+    """
+    Laps, best sectors, hypothetical and average lap for one result row
+    """
+
+    analysis = {}
+
+    sr = result['safety_rating']
+    elo = result['rating']
+    if result['ratingGain'] != None:
+        elo += result['ratingGain']
+    data_laps = result['lapDetail']
+
+    numbers = array('i')
+    valid = bytearray((len(data_laps or []) + 7) // 8)
+    counts = array('i')
+    times = array('i')
+    laps_added = set()
+    for data_lap in data_laps or []:
+        lap_number = data_lap['car_lap']
+        if lap_number in laps_added:
+            continue
+        laps_added.add(lap_number)
+
+        index = len(numbers)
+        numbers.append(lap_number)
+        if data_lap['lap_valid'] != 0:
+            valid[index // 8] |= 1 << (index % 8)
+        counts.append(len(data_lap['splits']))
+        for data_sector in data_lap['splits']:
+            times.append(LapTime.parse(data_sector).ms)
+
+    laps = LapTable(numbers, valid[:(len(numbers) + 7) // 8], counts, times)
+
+    statistics = None
+    if lap_matrix.available():
+        statistics = lap_matrix.lap_statistics(laps)
+    if statistics is None:
+        statistics = lap_statistics(laps)
+    best, consistency, averages = statistics
+
+    hypothetical_lap = Lap(-1)
+    for xbest in best:
+        if 'Sector' in xbest:
+            hypothetical_lap.add_sector(
+                Sector(
+                    best[xbest], 
+                    int(xbest.replace('Sector ', ''))
+                    )
+                )
+    analysis['hypothetical'] = hypothetical_lap
+
+    analysis['consistency'] = consistency
+
+    average_lap = Lap(-2)
+    for sector_number in range(1, 4):
+        sector_key = f'Sector {sector_number}'
+        if sector_key in averages:
+            avg_sector = Sector(averages[sector_key], sector_number)
+            average_lap.add_sector(avg_sector)
+
+
+    analysis['average'] = average_lap
+
+    split = result['split']
+    if not split:
+        split = -1
+
+    return {
+        'best': best,
+        'laps': laps,
+        'best_lap': parse_best_lap(result['bestlap']),
+        'split': split,
+        'car_class': result['class'],
+        'car_name': result['car_name'],
+        'car_year': result['year'],
+        'total_time': result['time'],
+        'dnf': bool(result['dnf']),
+        'gap': result['gap'],
+        'dns': bool(result['dns']),
+        'incidents': result['incidents'],
+        'name': f"{result['vorname']} {result['nachname']}",
+        'analysis': analysis,
+        'elo': elo,
+        'safety_rating': sr
+    }
+
+
+def gather_data(session_id: int):
+    replace_print(f'gathering session {session_id}  ')
+    cache = load_cache(session_id)
+    if cache:
+        return cache
+
+    return fetch_session(session_id)
+
+def fetch_session(session_id: int):
+    """
+    Download a session and store it in the cache
+    """
+
+    url = f'{BASE_URL}race/{session_id}'
+
+    request = http_request(url)
+    data = request.json()
+    save_cache(session_id, data)
+
+    return data
+
+def prefetch_sessions(session_ids: list, workers: int = FETCH_WORKERS):
+    """
+    Download every session that isn't cached yet using a pool of workers.
+    Returns the number of sessions downloaded.
+    """
+
+    # dict.fromkeys drops repeats and keeps the order
+    missing = [session_id for session_id in dict.fromkeys(session_ids) if not cache_exists(session_id)]
+
+    if len(missing) == 0:
+        return 0
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        for counter, _ in enumerate(pool.map(fetch_session, missing), 1):
+            replace_print(f'downloaded {counter}/{len(missing)} sessions  ')
+
+    return len(missing)
+
+def lap_statistics(laps: LapTable):
+    """
+    (best, consistency, averages) for a race's laps:
+
+    best         fastest time for each sector and for a whole lap, valid laps only
+    consistency  seconds between the slowest and fastest of each sector
+    averages     average of each sector
+
+    Consistency and averages leave out invalid laps and lap 1.
+    lap_matrix.lap_statistics does the same with NumPy.
+    """
+
+    best = {}
+    sector_times = {}
+    position = 0
+    for index, number in enumerate(laps.numbers):
+        valid = laps.is_valid(index)
+        lap_ms = 0
+        for sector_number in range(1, laps.counts[index] + 1):
+            ms = laps.times[position]
+            position += 1
+            lap_ms += ms
+
+            sector_header = f'Sector {sector_number}'
+            if sector_header not in sector_times:
+                sector_times[sector_header] = []
+            if valid:
+                if number != 1:
+                    sector_times[sector_header].append(ms)
+                if sector_header not in best or ms < best[sector_header]:
+                    best[sector_header] = ms
+
+        if valid:
+            if 'total' not in best or lap_ms < best['total']:
+                best['total'] = lap_ms
+
+    consistency = {}
+    averages = {}
+    for key, values in sector_times.items():
+        minmax = min_max(values)
+        consistency[key] = (minmax['max'] - minmax['min']).total_seconds()
+        averages[key] = average_time(values)
+
+    return {key: LapTime(ms) for key, ms in best.items()}, consistency, averages
+
+
+def parse_best_lap(value):
+    """
+    The API reports a best lap even for drivers that never set one.
+    Returns None when there is no usable time.
+    """
+
+    if not value:
+        return None
+    try:
+        return LapTime.parse(value)
+    except (TypeError, ValueError):
+        return None
+
+def date_to_epoch(date_string: str):
+    # "2021-08-28 00:15:00"
+    dt = datetime.strptime(date_string, '%Y-%m-%d %H:%M:%S')
+    epoch = dt.timestamp()
+    return int(epoch)
+
+
+def cache_exists(session_id):
+    return session_cache.exists(session_id)
+
+
+def load_cache(session_id):
+    return session_cache.load(session_id)
+
+
+def save_cache(session_id, data):
+    session_cache.save(session_id, data)
@@ -0,0 +1,518 @@
+import gzip
+import json
+import sqlite3
+import threading
+
+from collections import Counter
+from os import makedirs, path, remove, replace, scandir, stat, utime
+
+from classes.laptime import LapTime
+
+SESSION_CACHE_DIR = './json/session_cache/'
+SESSION_CACHE_DB = './json/session_cache.sqlite'
+
+# 'json' keeps one file per session in SESSION_CACHE_DIR.
+# 'sqlite' keeps every session in SESSION_CACHE_DB, along with
+# tables of results and laps that can be queried directly.
+CACHE_BACKEND = 'json'
+
+# Disk budget for the JSON cache in bytes (None for no limit).
+# Eviction brings it down to EVICT_TO of the budget so it doesn't
+# run again on the very next download.
+CACHE_BUDGET = 2 * 1024 ** 3
+EVICT_TO = .9
+COMPRESSION_LEVEL = 6
+
+# The parts of a race/{id} payload anything here reads (Session,
+# SessionIndex, parse_result, the chat index and the SQLite tables).
+# True keeps everything under a key, a dict keeps only the keys it
+# lists and '*' stands for every key.  Lists are projected item by item.
+RESULT_PROJECTION = {
+    'driver_id': True,
+    'vorname': True,
+    'nachname': True,
+    'position': True,
+    'split': True,
+    'class': True,
+    'car_name': True,
+    'year': True,
+    'bestlap': True,
+    'time': True,
+    'gap': True,
+    'dnf': True,
+    'dns': True,
+    'incidents': True,
+    'rating': True,
+    'ratingGain': True,
+    'safety_rating': True,
+    'lapDetail': {
+        'car_lap': True,
+        'lap_valid': True,
+        'splits': True,
+    },
+}
+SESSION_PROJECTION = {
+    'race_date': True,
+    'event_id': True,
+    'track': {'track_name': True},
+    'server_settings': {'server_settings': {'event': {'data': {
+        'ambientTemp': True,
+        'cloudLevel': True,
+        'rain': True,
+        'weatherRandomness': True,
+    }}}},
+    'event': {'settings': {'season_event_settings': {'default_server_settings': {
+        'pitstop_mandatory': True,
+    }}}},
+    'chat': True,
+    'race_results_splits': {'*': {'OVERALL': RESULT_PROJECTION}},
+}
+
+
+def project(value, projection=SESSION_PROJECTION):
+    """
+    Copy of value with only the parts named in projection
+    """
+
+    if projection is True:
+        return value
+
+    if type(value) == list:
+        return [project(item, projection) for item in value]
+
+    if type(value) != dict:
+        return value
+
+    if '*' in projection:
+        return {key: project(item, projection['*']) for key, item in value.items()}
+
+    return {key: project(value[key], projection[key]) for key in projection if key in value}
+
+
+class JsonCache:
+    """
+    One gzipped {session_id}.json.gz per session.  Plain {session_id}.json
+    files from before compression are still read.
+
+    Once the directory grows past CACHE_BUDGET bytes the sessions read
+    longest ago are deleted until it's back under EVICT_TO of the budget.
+    Sessions returned by the pinned callback (the ones tracked drivers
+    took part in) are never evicted, and neither are sessions pinned
+    while a driver that needs them is being updated.
+    """
+
+    def __init__(self, directory: str = SESSION_CACHE_DIR, budget: int = CACHE_BUDGET):
+        self.directory = directory
+        self.budget = budget
+        self.pinned = lambda: set()
+        # session id -> how many updates in progress need it
+        self.in_flight = Counter()
+        self.size = None
+        # Cache size left by the last eviction if it ran out of
+        # unpinned sessions before reaching its target, else None
+        self.pinned_size = None
+        self.lock = threading.Lock()
+
+    def pin(self, session_ids):
+        """
+        Keep these sessions until they're unpinned, for a driver
+        that hasn't saved the Races built from them yet
+        """
+
+        with self.lock:
+            self.in_flight.update(session_ids)
+
+    def unpin(self, session_ids):
+        with self.lock:
+            self.in_flight.subtract(session_ids)
+            self.in_flight = +self.in_flight
+
+    def file_name(self, session_id: int):
+        return f'{self.directory}{session_id}.json.gz'
+
+    def plain_file_name(self, session_id: int):
+        return f'{self.directory}{session_id}.json'
+
+    def exists(self, session_id: int):
+        return path.exists(self.file_name(session_id)) or path.exists(self.plain_file_name(session_id))
+
+    def load(self, session_id: int):
+        file_name = self.file_name(session_id)
+        if path.exists(file_name):
+            opener = gzip.open
+        else:
+            file_name = self.plain_file_name(session_id)
+            opener = open
+            if not path.exists(file_name):
+                return None
+
+        try:
+            with opener(file_name, 'rt') as json_file:
+                data = json.load(json_file)
+            # The modified time doubles as the last access time for eviction
+            utime(file_name)
+        except FileNotFoundError:
+            # Evicted by another thread between the check and the read
+            return None
+
+        return data
+
+    def save(self, session_id: int, data: dict):
+        # Write to a temporary file first so a reader on another
+        # thread never sees a half written session.
+        file_name = self.file_name(session_id)
+        temp_file = f'{file_name}.{threading.get_ident()}.tmp'
+        with gzip.open(temp_file, 'wt', compresslevel=COMPRESSION_LEVEL) as out_file:
+            json.dump(project(data), out_file)
+        added = stat(temp_file).st_size
+
+        with self.lock:
+            for old_file in (file_name, self.plain_file_name(session_id)):
+                if path.exists(old_file):
+                    added -= stat(old_file).st_size
+            replace(temp_file, file_name)
+            plain_file = self.plain_file_name(session_id)
+            if path.exists(plain_file):
+                remove(plain_file)
+            if self.size is not None:
+                self.size += added
+
+        self.enforce_budget()
+
+    def entries(self):
+        """
+        (last access, size, session id, file name) for every cached session
+        """
+
+        if not path.exists(self.directory):
+            return []
+
+        output = []
+        for entry in scandir(self.directory):
+            session_id = cached_session_id(entry.name)
+            if session_id is not None:
+                info = entry.stat()
+                output.append((info.st_mtime, info.st_size, session_id, entry.path))
+
+        return output
+
+    def session_ids(self):
+        return list({session_id for _, _, session_id, _ in self.entries()})
+
+    def disk_usage(self):
+        with self.lock:
+            if self.size is None:
+                self.size = sum(size for _, size, _, _ in self.entries())
+            return self.size
+
+    def enforce_budget(self):
+        if self.budget is None or self.disk_usage() <= self.budget:
+            return
+
+        # Finding the pinned sessions reads every saved driver.  If the
+        # last pass found nothing left to delete, wait until enough has
+        # been downloaded since for another pass to be worth it.
+        target = int(self.budget * EVICT_TO)
+        if self.pinned_size is not None and self.disk_usage() - self.pinned_size < self.budget - target:
+            return
+
+        self.evict(target)
+
+    def evict(self, target: int):
+        """
+        Delete the least recently read sessions until the cache fits
+        in target bytes.  Returns how many sessions were deleted.
+        """
+
+        pinned = self.pinned()
+        evicted = 0
+        with self.lock:
+            entries = self.entries()
+            self.size = sum(size for _, size, _, _ in entries)
+            for _, size, session_id, file_name in sorted(entries):
+                if self.size <= target:
+                    break
+                if session_id in pinned or session_id in self.in_flight:
+                    continue
+                try:
+                    remove(file_name)
+                except FileNotFoundError:
+                    pass
+                self.size -= size
+                evicted += 1
+
+            self.pinned_size = self.size if self.size > target else None
+
+        return evicted
+
+    def compress_all(self):
+        """
+        Rewrite plain .json sessions as .json.gz.  Returns how many were rewritten.
+        """
+
+        compressed = 0
+        for _, _, session_id, file_name in self.entries():
+            if file_name.endswith('.json'):
+                self.save(session_id, self.load(session_id))
+                compressed += 1
+
+        return compressed
+
+
+def cached_session_id(file_name: str):
+    for extension in ('.json.gz', '.json'):
+        if file_name.endswith(extension):
+            name = file_name[:-len(extension)]
+            if name.isdigit():
+                return int(name)
+
+    return None
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id INTEGER PRIMARY KEY,
+    race_date TEXT,
+    track TEXT,
+    event_id INTEGER,
+    payload TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS results (
+    session_id INTEGER NOT NULL,
+    driver_id INTEGER NOT NULL,
+    name TEXT,
+    split INTEGER,
+    car_class TEXT,
+    car_name TEXT,
+    car_year INTEGER,
+    position INTEGER,
+    best_lap_ms INTEGER,
+    total_time TEXT,
+    gap TEXT,
+    dnf INTEGER,
+    dns INTEGER,
+    incidents INTEGER,
+    elo INTEGER,
+    safety_rating REAL,
+    PRIMARY KEY (session_id, driver_id)
+);
+CREATE TABLE IF NOT EXISTS laps (
+    session_id INTEGER NOT NULL,
+    driver_id INTEGER NOT NULL,
+    lap INTEGER NOT NULL,
+    valid INTEGER,
+    time_ms INTEGER,
+    sectors TEXT,
+    PRIMARY KEY (session_id, driver_id, lap)
+);
+CREATE INDEX IF NOT EXISTS sessions_track ON sessions (track, race_date);
+CREATE INDEX IF NOT EXISTS sessions_date ON sessions (race_date);
+CREATE INDEX IF NOT EXISTS results_driver ON results (driver_id, session_id);
+"""
+
+
+class SqliteCache:
+    """
+    Every session in one SQLite database (WAL mode, so readers don't
+    wait on the download workers).  Alongside the trimmed payload each
+    session's result rows and laps are written to their own tables.
+    """
+
+    def __init__(self, file_name: str = SESSION_CACHE_DB):
+        self.file_name = file_name
+        self.local = threading.local()
+
+        directory = path.dirname(file_name)
+        if directory and not path.exists(directory):
+            makedirs(directory)
+        with self.connection() as connection:
+            connection.executescript(SQLITE_SCHEMA)
+
+    def connection(self):
+        """
+        Connections can't be shared between threads, so each gets its own
+        """
+
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.file_name, timeout=30)
+            connection.row_factory = sqlite3.Row
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self.local.connection = connection
+
+        return connection
+
+    # Nothing is ever evicted from the database
+    def pin(self, session_ids):
+        pass
+
+    def unpin(self, session_ids):
+        pass
+
+    def exists(self, session_id: int):
+        row = self.connection().execute(
+            'SELECT 1 FROM sessions WHERE session_id = ?', (session_id,)
+        ).fetchone()
+        return row is not None
+
+    def load(self, session_id: int):
+        row = self.connection().execute(
+            'SELECT payload FROM sessions WHERE session_id = ?', (session_id,)
+        ).fetchone()
+        if row is None:
+            return None
+
+        return json.loads(row['payload'])
+
+    def save(self, session_id: int, data: dict):
+        data = project(data)
+        results, laps = extract_rows(session_id, data)
+
+        with self.connection() as connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?, ?)',
+                (
+                    session_id,
+                    data.get('race_date'),
+                    data.get('track', {}).get('track_name'),
+                    data.get('event_id'),
+                    json.dumps(data)
+                )
+            )
+            connection.execute('DELETE FROM results WHERE session_id = ?', (session_id,))
+            connection.execute('DELETE FROM laps WHERE session_id = ?', (session_id,))
+            connection.executemany(
+                'INSERT OR IGNORE INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                results
+            )
+            connection.executemany('INSERT OR IGNORE INTO laps VALUES (?, ?, ?, ?, ?, ?)', laps)
+
+    def session_ids(self):
+        return [row[0] for row in self.connection().execute('SELECT session_id FROM sessions')]
+
+    def query(self, sql: str, parameters=()):
+        """
+        Run SQL against the sessions, results and laps tables
+        """
+
+        return self.connection().execute(sql, parameters).fetchall()
+
+
+def extract_rows(session_id: int, data: dict):
+    """
+    (results, laps) rows for the SQLite tables.  The first row for a
+    driver wins, the same as SessionIndex.
+    """
+
+    results = []
+    laps = []
+    seen = set()
+    for data_split in data.get('race_results_splits', []):
+        if type(data_split) != dict:
+            continue
+
+        for xcar_class in data_split:
+            for result in data_split[xcar_class]['OVERALL']:
+                driver_id = result['driver_id']
+                if driver_id in seen:
+                    continue
+                seen.add(driver_id)
+
+                elo = result.get('rating')
+                if elo is not None and result.get('ratingGain') is not None:
+                    elo += result['ratingGain']
+
+                results.append((
+                    session_id,
+                    driver_id,
+                    f"{result.get('vorname')} {result.get('nachname')}",
+                    result.get('split') or -1,
+                    result.get('class'),
+                    result.get('car_name'),
+                    result.get('year'),
+                    result.get('position'),
+                    time_ms(result.get('bestlap')),
+                    result.get('time'),
+                    result.get('gap'),
+                    int(bool(result.get('dnf'))),
+                    int(bool(result.get('dns'))),
+                    result.get('incidents'),
+                    elo,
+                    result.get('safety_rating'),
+                ))
+
+                lap_numbers = set()
+                for data_lap in result.get('lapDetail') or []:
+                    if data_lap['car_lap'] in lap_numbers:
+                        continue
+                    lap_numbers.add(data_lap['car_lap'])
+
+                    sectors = [time_ms(split) for split in data_lap['splits']]
+                    total = None
+                    if sectors and None not in sectors:
+                        total = sum(sectors)
+                    laps.append((
+                        session_id,
+                        driver_id,
+                        data_lap['car_lap'],
+                        int(data_lap['lap_valid'] != 0),
+                        total,
+                        json.dumps(sectors),
+                    ))
+
+    return results, laps
+
+
+def time_ms(value):
+    if not value:
+        return None
+    try:
+        return LapTime.parse(value).ms
+    except (TypeError, ValueError):
+        return None
+
+
+def open_cache(backend: str = CACHE_BACKEND):
+    if backend == 'sqlite':
+        return SqliteCache()
+
+    return JsonCache()
+
+
+def migrate_json_cache(source=None, target=None):
+    """
+    Copy every session from the JSON directory into the SQLite cache.
+    Sessions already in the database are skipped.  Returns how many were copied.
+    """
+
+    source = source or JsonCache()
+    target = target or SqliteCache()
+
+    copied = 0
+    for session_id in source.session_ids():
+        if target.exists(session_id):
+            continue
+        target.save(session_id, source.load(session_id))
+        copied += 1
+
+    return copied
+
+
+def reproject_cache(cache):
+    """
+    Save every cached session again, trimmed to SESSION_PROJECTION.
+    Returns how many were rewritten.
+    """
+
+    rewritten = 0
+    for session_id in cache.session_ids():
+        data = cache.load(session_id)
+        if data is not None:
+            cache.save(session_id, data)
+            rewritten += 1
+
+    return rewritten
+
+
+session_cache = open_cache()
@@ -0,0 +1,58 @@
+import threading
+
+
+class SharedSessionIndex:
+    """
+    Which tracked drivers took part in each session.
+    session_id -> {driver_id: entry}
+    Drivers keep it up to date as sessions are added and removed.
+    """
+
+    sessions: dict
+
+    def __init__(self):
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def add(self, driver, race):
+        entry = {
+            'driver': driver,
+            'split': race.split,
+            'finish': race.finish_position,
+            'dns': race.dns,
+            'dnf': race.dnf,
+        }
+
+        with self.lock:
+            if race.session_id not in self.sessions:
+                self.sessions[race.session_id] = {}
+            self.sessions[race.session_id][driver.id] = entry
+
+    def add_driver(self, driver):
+        for race in driver.sessions:
+            self.add(driver, race)
+
+    def remove_driver(self, driver):
+        with self.lock:
+            for race in driver.sessions:
+                entries = self.sessions.get(race.session_id)
+                if entries is None:
+                    continue
+                entries.pop(driver.id, None)
+                if len(entries) == 0:
+                    del self.sessions[race.session_id]
+
+    def drivers_in(self, session_id: int):
+        """
+        Tracked drivers in a session, {driver_id: entry}
+        """
+
+        with self.lock:
+            return dict(self.sessions.get(session_id, {}))
+
+    def session_ids(self):
+        with self.lock:
+            return set(self.sessions.keys())
+
+
+shared_index = SharedSessionIndex()
@@ -0,0 +1,292 @@
+import pickle
+from os import listdir, path, remove, replace, stat
+
+from classes import codec
+from classes.track_stats import TrackStats
+
+PICKLE_DIR = './pickles/'
+
+# Fold the journal back into the snapshot once it has this many records
+COMPACT_AFTER = 100
+
+# Fields older pickles may not have
+LEGACY_HEADER_DEFAULTS = {
+    'notes': '',
+    'elo': 0,
+    'safety_rating': 0.0,
+    'complete': False,
+    'countable_laps': 0,
+    'valid_laps': 0,
+    'invalid_laps': 0,
+    'tracks': {},
+}
+LEGACY_RACE_DEFAULTS = {
+    'valid_laps': 0,
+    'invalid_laps': 0,
+    'countable_laps': 0,
+    'valid_lap_percentage': 0,
+    'invalid_lap_percentage': 0,
+    'analysis': {},
+    'best': {},
+}
+
+
+class DriverStorage:
+    """
+    On-disk layout for one driver, all in the versioned format from codec:
+
+    {id}.snap     header and every Race, rewritten only on compaction
+    {id}.journal  Races added since the snapshot, appended one record at a time
+    {id}.head     small fields (notes, counters, track aggregates), rewritten on every save
+
+    Loading reads the snapshot, then the header over it, then the journal.
+    Drivers saved as pickles ({id}.pkl, .log, .header) are still read,
+    and are converted the next time they're saved.
+    """
+
+    def __init__(self, driver_id: int, directory: str = PICKLE_DIR):
+        self.snapshot_file = f'{directory}{driver_id}.snap'
+        self.journal_file = f'{directory}{driver_id}.journal'
+        self.header_file = f'{directory}{driver_id}.head'
+        self.legacy_files = [
+            f'{directory}{driver_id}.pkl',
+            f'{directory}{driver_id}.log',
+            f'{directory}{driver_id}.header',
+        ]
+        self.journal_records = 0
+        self.damaged = False
+        self.outdated = False
+
+    def exists(self):
+        return path.exists(self.snapshot_file) or self.is_legacy()
+
+    def is_legacy(self):
+        return not path.exists(self.snapshot_file) and path.exists(self.legacy_files[0])
+
+    def load(self):
+        """
+        Returns (header, sessions), or None if nothing has been saved
+        """
+
+        if self.is_legacy():
+            return self.load_legacy()
+
+        if not path.exists(self.snapshot_file):
+            return None
+
+        header, sessions = read_snapshot(self.snapshot_file)
+        if path.exists(self.header_file):
+            header = read_header(self.header_file)
+        journal, self.damaged = read_journal(self.journal_file)
+        self.journal_records = len(journal)
+        # Anything written by an older schema is rewritten on the next save
+        self.outdated = any(
+            file_version(file_name) < codec.SCHEMA_VERSION
+            for file_name in (self.snapshot_file, self.journal_file, self.header_file)
+            if path.exists(file_name) and stat(file_name).st_size > 0
+        )
+
+        return header, sessions + journal
+
+    def load_legacy(self):
+        snapshot_file, log_file, header_file = self.legacy_files
+
+        with open(snapshot_file, 'rb') as in_file:
+            state = pickle.load(in_file).__dict__
+        sessions = [legacy_race(race) for race in state['_sessions']]
+        header = legacy_header(state, len(sessions))
+
+        logged = read_pickle_log(log_file)
+        if path.exists(header_file):
+            with open(header_file, 'rb') as in_file:
+                header.update(pickle.load(in_file))
+        header['tracks'] = TrackStats.from_legacy(header['tracks'])
+
+        return header, sessions + [legacy_race(race) for race in logged]
+
+    def session_ids(self):
+        """
+        Ids of every saved session, without building the Races
+        """
+
+        if self.is_legacy():
+            return {race.session_id for race in self.load()[1]}
+
+        ids = set()
+        for file_name, first in ((self.snapshot_file, 1), (self.journal_file, 0)):
+            if not path.exists(file_name) or stat(file_name).st_size < codec.FILE_HEADER.size:
+                continue
+            version, data = read_file(file_name)
+            records, _ = codec.read_frames(data, codec.FILE_HEADER.size)
+            ids.update(codec.race_session_id(record, version) for record in records[first:])
+
+        return ids
+
+    def append_sessions(self, races: list):
+        if len(races) == 0:
+            return
+
+        records = [codec.frame(codec.encode_race(race)) for race in races]
+        with open(self.journal_file, 'ab') as journal:
+            if journal.tell() == 0:
+                journal.write(codec.file_header())
+            journal.write(b''.join(records))
+        self.journal_records += len(races)
+
+    def write_header(self, header: dict):
+        write_file(self.header_file, codec.file_header() + codec.encode_header(header))
+
+    def needs_compaction(self):
+        if self.damaged or self.outdated or not path.exists(self.snapshot_file):
+            return True
+
+        return self.journal_records >= COMPACT_AFTER
+
+    def compact(self, header: dict, sessions: list):
+        """
+        Write a fresh snapshot and start an empty journal.
+        Any pickles left from the old format go as well.
+        """
+
+        records = [codec.frame(codec.encode_header(header))]
+        records += [codec.frame(codec.encode_race(race)) for race in sessions]
+        write_file(self.snapshot_file, codec.file_header() + b''.join(records))
+
+        for file_name in [self.journal_file, self.header_file] + self.legacy_files:
+            if path.exists(file_name):
+                remove(file_name)
+        self.journal_records = 0
+        self.damaged = False
+        self.outdated = False
+
+    def modified(self):
+        """
+        When this driver was last saved.  Every save writes the header
+        or the snapshot.
+        """
+
+        for file_name in [self.header_file, self.snapshot_file] + self.legacy_files[::-1]:
+            if path.exists(file_name):
+                return stat(file_name).st_mtime
+
+        return None
+
+    def delete(self):
+        for file_name in [self.snapshot_file, self.journal_file, self.header_file] + self.legacy_files:
+            if path.exists(file_name):
+                remove(file_name)
+
+
+def saved_driver_ids(directory: str = PICKLE_DIR):
+    """
+    Every driver with a snapshot, in either format
+    """
+
+    if not path.exists(directory):
+        return []
+
+    ids = set()
+    for file_name in listdir(directory):
+        name, extension = path.splitext(file_name)
+        if extension in ('.snap', '.pkl') and name.isdigit():
+            ids.add(int(name))
+
+    return sorted(ids)
+
+
+def read_file(file_name):
+    with open(file_name, 'rb') as in_file:
+        data = in_file.read()
+
+    return codec.read_file_header(data), data
+
+
+def file_version(file_name):
+    with open(file_name, 'rb') as in_file:
+        return codec.read_file_header(in_file.read(codec.FILE_HEADER.size))
+
+
+def write_file(file_name, data: bytes):
+    # Replace the file in one step so a crash can't leave half of it behind
+    temp_file = f'{file_name}.tmp'
+    with open(temp_file, 'wb') as out_file:
+        out_file.write(data)
+    replace(temp_file, file_name)
+
+
+def read_snapshot(file_name):
+    version, data = read_file(file_name)
+    records, complete = codec.read_frames(data, codec.FILE_HEADER.size)
+    if not complete or len(records) == 0:
+        raise ValueError(f'{file_name} is cut short')
+
+    header = codec.decode_header(records[0], version)
+    sessions = [codec.decode_race(record, version) for record in records[1:]]
+
+    return header, sessions
+
+
+def read_header(file_name):
+    version, data = read_file(file_name)
+    return codec.decode_header(data[codec.FILE_HEADER.size:], version)
+
+
+def read_journal(file_name):
+    """
+    Every Race in a journal, and whether the journal ended in a
+    record cut short by a crash mid-append (which is dropped).
+    """
+
+    if not path.exists(file_name) or stat(file_name).st_size == 0:
+        return [], False
+    if stat(file_name).st_size < codec.FILE_HEADER.size:
+        return [], True
+
+    version, data = read_file(file_name)
+    records, complete = codec.read_frames(data, codec.FILE_HEADER.size)
+
+    return [codec.decode_race(record, version) for record in records], not complete
+
+
+def read_pickle_log(file_name):
+    """
+    Races from an old pickle session log, up to the first damaged record
+    """
+
+    records = []
+    if not path.exists(file_name):
+        return records
+
+    with open(file_name, 'rb') as log:
+        while True:
+            try:
+                records.append(pickle.load(log))
+            except (EOFError, pickle.UnpicklingError, ValueError, AttributeError, IndexError):
+                break
+
+    return records
+
+
+def legacy_header(state: dict, races: int):
+    """
+    Header fields from a pickled Driver's attributes
+    """
+
+    header = {}
+    for field in ('name', 'wins', 'podiums', 'dnf', 'dns', 'incident_points', 'incident_points_per_race'):
+        header[field] = state[field]
+    for field, default in LEGACY_HEADER_DEFAULTS.items():
+        header[field] = state.get(field, state.get(f'_{field}', default))
+    if type(header['elo']) != int:
+        header['elo'] = 0
+    header['races'] = races
+
+    return header
+
+
+def legacy_race(race):
+    for field, default in LEGACY_RACE_DEFAULTS.items():
+        if not hasattr(race, field):
+            setattr(race, field, default)
+
+    return race
@@ -0,0 +1,185 @@
+from classes.laptime import LapTime, ZERO_TIME, SLOWEST_TIME
+
+
+class CarStats:
+    """
+    Running totals for one car on one track, all in milliseconds.
+    Adding a race is O(1); nothing is kept per race.
+    """
+
+    __slots__ = (
+        'races', 'best_ms', 'average_count', 'average_sum', 'average_min', 'average_max',
+        'valid_laps', 'invalid_laps', 'countable_laps'
+    )
+
+    def __init__(self):
+        self.races = 0
+        self.best_ms = None
+        # Each race's average lap
+        self.average_count = 0
+        self.average_sum = 0
+        self.average_min = None
+        self.average_max = None
+        self.valid_laps = 0
+        self.invalid_laps = 0
+        # We don't count Lap 1, and if (mandatory pitstop = true AND invalid laps > 1, we subtract 2)
+        self.countable_laps = 0
+
+    def add_race(self, race):
+        self.races += 1
+        self.valid_laps += race.valid_laps
+        self.invalid_laps += race.invalid_laps
+        self.countable_laps += race.countable_laps
+
+        if race.best_lap:
+            self.add_best(race.best_lap.ms)
+
+        average = race.analysis['average'].time
+        if average != ZERO_TIME:
+            self.add_average(average.ms)
+
+    def add_best(self, ms: int):
+        if self.best_ms is None or ms < self.best_ms:
+            self.best_ms = ms
+
+    def add_average(self, ms: int):
+        self.average_count += 1
+        self.average_sum += ms
+        if self.average_min is None or ms < self.average_min:
+            self.average_min = ms
+        if self.average_max is None or ms > self.average_max:
+            self.average_max = ms
+
+    def merge(self, other):
+        self.races += other.races
+        self.valid_laps += other.valid_laps
+        self.invalid_laps += other.invalid_laps
+        self.countable_laps += other.countable_laps
+        if other.best_ms is not None:
+            self.add_best(other.best_ms)
+        if other.average_count > 0:
+            self.average_count += other.average_count
+            self.average_sum += other.average_sum
+            if self.average_min is None or other.average_min < self.average_min:
+                self.average_min = other.average_min
+            if self.average_max is None or other.average_max > self.average_max:
+                self.average_max = other.average_max
+
+        return self
+
+    @property
+    def best(self):
+        """
+        Fastest lap, SLOWEST_TIME if there hasn't been one
+        """
+
+        return SLOWEST_TIME if self.best_ms is None else LapTime(self.best_ms)
+
+    @property
+    def average(self):
+        """
+        Average of the races' average laps, None if there are none
+        """
+
+        if self.average_count == 0:
+            return None
+
+        return LapTime(round(self.average_sum / self.average_count))
+
+    @property
+    def best_average(self):
+        return ZERO_TIME if self.average_min is None else LapTime(self.average_min)
+
+    @property
+    def worst_average(self):
+        return ZERO_TIME if self.average_max is None else LapTime(self.average_max)
+
+    def json(self):
+        return {
+            'races': self.races,
+            'best': self.best.json(),
+            'average': self.average.json() if self.average else None,
+            'best_average': self.best_average.json(),
+            'worst_average': self.worst_average.json(),
+            'valid_laps': self.valid_laps,
+            'invalid_laps': self.invalid_laps,
+            'countable_laps': self.countable_laps,
+        }
+
+
+class TrackStats:
+    """
+    track name -> car -> CarStats for one driver.
+    Reads like the nested dict it replaces.
+    """
+
+    __slots__ = ('tracks',)
+
+    def __init__(self):
+        self.tracks = {}
+
+    def __iter__(self):
+        return iter(self.tracks)
+
+    def __len__(self):
+        return len(self.tracks)
+
+    def __contains__(self, track: str):
+        return track in self.tracks
+
+    def __getitem__(self, track: str):
+        return self.tracks[track]
+
+    def items(self):
+        return self.tracks.items()
+
+    def car(self, track: str, car: str):
+        if track not in self.tracks:
+            self.tracks[track] = {}
+        if car not in self.tracks[track]:
+            self.tracks[track][car] = CarStats()
+
+        return self.tracks[track][car]
+
+    def add_race(self, race):
+        """
+        Count a race that was started and has laps
+        """
+
+        self.car(race.track, f'{race.car_year} {race.car_name}').add_race(race)
+
+    def merge(self, other):
+        for track, cars in other.items():
+            for car, stats in cars.items():
+                self.car(track, car).merge(stats)
+
+        return self
+
+    def json(self):
+        return {
+            track: {car: stats.json() for car, stats in cars.items()}
+            for track, cars in self.tracks.items()
+        }
+
+    @classmethod
+    def from_legacy(cls, tracks: dict):
+        """
+        Build from the old nested dicts, which kept every race's
+        average lap in a list (as strings in the oldest pickles)
+        """
+
+        output = cls()
+        for track, cars in tracks.items():
+            for car, data in cars.items():
+                stats = output.car(track, car)
+                stats.races = data['races']
+                stats.valid_laps = data.get('valid_laps', 0)
+                stats.invalid_laps = data.get('invalid_laps', 0)
+                stats.countable_laps = data.get('countable_laps', 0)
+                best = LapTime.parse(data['best'])
+                if best != SLOWEST_TIME:
+                    stats.add_best(best.ms)
+                for average in data['average_laps']:
+                    stats.add_average(LapTime.parse(average).ms)
+
+        return output
@@ -0,0 +1,165 @@
+import queue
+import threading
+import time
+
+from classes.driver import Driver, UPDATE_WORKERS
+from classes.printing import quiet_thread
+from classes.shared_index import shared_index
+
+JOB_KINDS = ('update', 'force_update', 'add')
+
+
+class UpdateQueue:
+    """
+    Driver updates that run on background threads while the prompt
+    keeps working.
+
+    A job is one command ('update all &' and so on) covering one or
+    more drivers.  Each driver is updated as a fresh copy, so the
+    Driver objects the interactive thread is reading never change
+    under it.  Finished copies wait in a queue until the interactive
+    thread swaps them in with collect().
+    """
+
+    def __init__(self, workers: int = UPDATE_WORKERS):
+        self.workers = workers
+        self.jobs = []
+        self.tasks = queue.Queue()
+        self.finished = queue.Queue()
+        self.busy_ids = set()
+        self.threads = []
+        self.lock = threading.Lock()
+
+    def submit(self, kind: str, summaries: dict, command: str = ''):
+        """
+        Queue a job.  summaries: driver id -> the driver's current
+        summary, or None for a driver that hasn't been added yet.
+        """
+
+        if kind not in JOB_KINDS:
+            raise ValueError(f'unknown job kind {kind}')
+
+        with self.lock:
+            job = {
+                'id': len(self.jobs) + 1,
+                'kind': kind,
+                'command': command or kind,
+                'total': len(summaries),
+                'done': 0,
+                'errors': [],
+                'started': time.time(),
+                'finished': None,
+            }
+            self.jobs.append(job)
+            self.busy_ids.update(summaries.keys())
+
+            while len(self.threads) < self.workers:
+                thread = threading.Thread(target=self.run, daemon=True)
+                thread.start()
+                self.threads.append(thread)
+
+        for driver_id, summary in summaries.items():
+            self.tasks.put((job, kind, driver_id, summary))
+
+        return job
+
+    def run(self):
+        quiet_thread()
+        while True:
+            task = self.tasks.get()
+            if task is None:
+                return
+
+            job, kind, driver_id, summary = task
+            driver = None
+            try:
+                driver = Driver(driver_id, summary)
+                if kind == 'force_update':
+                    driver.force_update()
+                else:
+                    driver.gather_sessions()
+            except Exception as e:
+                with self.lock:
+                    job['errors'].append((driver_id, str(e)))
+                # Creating the Driver saved it.  Don't leave a
+                # nameless driver behind for the next start.
+                if kind == 'add' and driver is not None:
+                    driver.delete()
+                # The copy may be half updated.  The interactive
+                # thread keeps the driver it already has, and puts
+                # it back in the shared index when it collects this.
+                elif driver is not None and driver.loaded:
+                    shared_index.remove_driver(driver)
+                driver = None
+
+            self.finished.put((job, driver_id, driver))
+
+    def collect(self):
+        """
+        Finished drivers as (job, driver id, Driver or None), and
+        the jobs that are now complete.  Call from the interactive
+        thread only.
+        """
+
+        handoffs = []
+        completed = []
+        while True:
+            try:
+                job, driver_id, driver = self.finished.get_nowait()
+            except queue.Empty:
+                break
+
+            handoffs.append((job, driver_id, driver))
+            with self.lock:
+                self.busy_ids.discard(driver_id)
+                job['done'] += 1
+                if job['done'] == job['total']:
+                    job['finished'] = time.time()
+                    completed.append(job)
+
+        return handoffs, completed
+
+    def is_busy(self, driver_id: int):
+        with self.lock:
+            return driver_id in self.busy_ids
+
+    def status(self):
+        """
+        Every job so far as a plain dict, oldest first
+        """
+
+        now = time.time()
+        with self.lock:
+            return [
+                {
+                    'id': job['id'],
+                    'command': job['command'],
+                    'done': job['done'],
+                    'total': job['total'],
+                    'failed': len(job['errors']),
+                    'running': job['finished'] is None,
+                    'seconds': round((job['finished'] or now) - job['started']),
+                }
+                for job in self.jobs
+            ]
+
+    def stop(self):
+        """
+        Drop the queued drivers and wait for the ones
+        being updated right now
+        """
+
+        while True:
+            try:
+                self.tasks.get_nowait()
+            except queue.Empty:
+                break
+
+        for _ in self.threads:
+            self.tasks.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+
+update_queue = UpdateQueue()
@@ -4,15 +4,22 @@ import colorama
 
 
 from itertools import tee
-from os import path, listdir
+from os import path
 from cmd import Cmd
 from termcolor import colored
-from datetime import datetime
 
 
-from classes.driver import Driver
+from classes.driver import Driver, add_drivers, update_drivers, rebuild_drivers, load_summaries, convert_pickles, card_text
 from classes.printing import COLOR_GREEN, print_side_by_side, clear_terminal
-from classes.race import compare_times, http_request, min_max
+from classes.shared_index import shared_index
+from classes.chat_index import chat_index
+from classes.http_client import HttpError, http_request
+from classes.laptime import SLOWEST_TIME
+from classes.storage import saved_driver_ids
+from classes.session import session_store
+from classes.reports import report_cache
+from classes.update_queue import update_queue
+from classes.session_cache import migrate_json_cache, reproject_cache, session_cache, JsonCache, SESSION_CACHE_DB
 
 PICKLE_DIR = './pickles/'
 
@@ -65,12 +72,46 @@ def pairwise(iterable):
     return zip(a, b)
 
 
-def list_saved_drivers():
+def parse_driver_ids(args: str):
     """
-    Returns an array of pickle files
+    Driver ids separated by spaces or commas, and/or names of files
+    holding them (one or more per line, # starts a comment).
+    None if anything else is given.
     """
 
-    return listdir(PICKLE_DIR)
+    def ids_in(text: str, files: bool):
+        output = []
+        for token in text.replace(',', ' ').split():
+            if token.isnumeric():
+                output.append(int(token))
+            elif files and path.isfile(token):
+                with open(token) as id_file:
+                    for line in id_file:
+                        found = ids_in(line.split('#')[0], False)
+                        if found is None:
+                            return None
+                        output += found
+            else:
+                return None
+        return output
+
+    ids = ids_in(args, True)
+    if ids is None:
+        return None
+
+    return list(dict.fromkeys(ids))
+
+
+def background_args(args: str):
+    """
+    Split a trailing "&" (run in the background) off a command's arguments
+    """
+
+    args = args.strip()
+    if args.endswith('&'):
+        return args[:-1].strip(), True
+
+    return args, False
 
 
 def sort_array_of_dicts(array: list, field: str, reverse: bool = True):
@@ -111,6 +152,90 @@ def id_in_drivers(id: int, drivers: list):
             return True
 
     return False
+
+
+def best_averages_by_track(drivers: list):
+    """
+    Every driver's best average lap on each track, fastest first.
+    track -> {'Drivers': {name: {'avg', 'seconds'}}, 'Best': fastest average}
+    """
+
+    data = {}
+    for driver in drivers:
+        for track_name in driver.tracks:
+            if track_name not in data:
+                data[track_name] = {'Drivers': {}, 'Best': SLOWEST_TIME}
+            
+            if driver.name not in data[track_name]['Drivers']:
+                data[track_name]['Drivers'][driver.name] = {
+                    'avg': '',
+                    'seconds': 999
+                }
+            
+            track_data = driver.tracks[track_name]
+            best_average = SLOWEST_TIME
+
+            for car in track_data:
+                if track_data[car].average:
+                    best_average_for_this_car = track_data[car].best_average
+                    if best_average_for_this_car < best_average:
+                        best_average = best_average_for_this_car
+            
+            
+            data[track_name]['Drivers'][driver.name]['avg'] = best_average
+            data[track_name]['Drivers'][driver.name]['seconds'] = best_average.total_seconds()
+
+            if best_average < data[track_name]['Best']:
+                data[track_name]['Best'] = best_average
+
+    for track_name in data:
+        ordered = {}
+
+        for k, v in sorted(data[track_name]['Drivers'].items(), key=lambda e: e[1]['seconds']):
+            ordered[k] = v
+
+        data[track_name]['Drivers'] = ordered
+
+    return data
+
+
+def shared_sessions(selected_driver, search_terms: list):
+    """
+    Sessions where selected_driver finished in the same split as
+    another tracked driver, optionally filtered by track or driver name.
+    driver name -> list of sessions
+    """
+
+    shared = {}
+    for session in selected_driver.sessions:
+        session_id = session.session_id
+        split = session.split
+        if not session.dns and not session.dnf:
+            for driver_id, entry in shared_index.drivers_in(session_id).items():
+                if driver_id == selected_driver.id:
+                    continue
+
+                driver = entry['driver']
+                include = True
+                data = {
+                    'session': session_id,
+                    'track': session.track,
+                    'date': session.date,
+                    'my position': session.finish_position,
+                    'their position': entry['finish'],
+                }
+
+                if entry['split'] == split and not entry['dns'] and not entry['dnf']:
+                    for term in search_terms:
+                        if (term.lower() not in data['track'].lower()) and (term.lower() not in driver.name.lower()):
+                            include = False
+
+                    if include == True:
+                        if driver.name not in shared:
+                            shared[driver.name] = []
+                        shared[driver.name].append(data)
+
+    return shared
 # / END UTILITY FUNCTIONS
 
 
@@ -119,15 +244,25 @@ def main():
 
 
     drivers = []
+    summaries = load_summaries()
 
 
-    for file_name in list_saved_drivers():
-        driver_id = file_name.replace('.pkl', '')
+    for driver_id in saved_driver_ids(PICKLE_DIR):
         drivers.append(
-            Driver(driver_id)
+            Driver(driver_id, summaries.get(driver_id))
             )
 
-        drivers.sort(key=lambda x: x.elo, reverse=True)
+    drivers.sort(key=lambda x: x.elo, reverse=True)
+
+
+    def load_all():
+        """
+        Commands that look across every driver's sessions need
+        the full history of everyone, not just the summaries.
+        """
+
+        for driver in drivers:
+            driver.ensure_loaded()
 
 
 
@@ -139,17 +274,100 @@ def main():
         def default(self, args):
             print(args)
 
+        def onecmd(self, line):
+            try:
+                return super().onecmd(line)
+            except HttpError as e:
+                print(colored(f'    {e}', COLOR_ERROR))
+                print('')
+
+        def precmd(self, line):
+            self.collect_updates()
+            return line
+
+        def collect_updates(self):
+            """
+            Swap in the drivers that background jobs have finished with
+            """
+
+            handoffs, completed = update_queue.collect()
+            if len(handoffs) > 0:
+                for job, driver_id, driver in handoffs:
+                    old = next((d for d in drivers if d.id == driver_id), None)
+
+                    # Failed, keep the driver we have.  The failed copy
+                    # took its shared sessions with it, so put them back.
+                    if driver is None:
+                        if old is not None and old.loaded:
+                            shared_index.add_driver(old)
+                        continue
+
+                    if old is None:
+                        drivers.append(driver)
+                        continue
+
+                    # The new object has already replaced the old one's shared sessions
+                    drivers[drivers.index(old)] = driver
+                    if self.selected_driver is old:
+                        self.selected_driver = driver
+
+                drivers.sort(key=lambda x: x.elo, reverse=True)
+                report_cache.bump()
+
+            for job in completed:
+                failed = len(job['errors'])
+                print(f"  [{job['id']}] {job['command']} finished: {colored(job['total'] - failed, 'blue')} updated, {failed} failed")
+                for driver_id, error in job['errors']:
+                    print(colored(f'    {driver_id}: {error}', COLOR_ERROR))
+
+        def busy(self, selected: list):
+            """
+            Print and return True if a background job is working on any of these drivers
+            """
+
+            busy = [driver.name or str(driver.id) for driver in selected if update_queue.is_busy(driver.id)]
+            if busy:
+                print(colored(f'    Still updating in the background: {", ".join(busy)}', COLOR_ERROR))
+                print('    Try again once "jobs" shows they are done')
+                return True
+
+            return False
+
+        def submit_job(self, kind: str, selected: list, command: str):
+            selected = [driver for driver in selected if not update_queue.is_busy(driver.id)]
+            if len(selected) == 0:
+                print('Those drivers are already being updated in the background')
+                return
+
+            job = update_queue.submit(kind, {driver.id: driver.summary() for driver in selected}, command)
+            print(f"  [{job['id']}] {command}: {job['total']} drivers in the background.  See \"jobs\".")
+
+        def do_jobs(self, args):
+            """
+            Background updates and how far along they are
+            """
+
+            jobs = update_queue.status()
+            if len(jobs) == 0:
+                print('No background jobs')
+                return
+
+            for job in jobs:
+                state = colored('running', 'yellow') if job['running'] else colored('done', 'green')
+                print(f"  [{job['id']}] {job['command']}  {state}  {job['done']}/{job['total']} drivers, {job['failed']} failed, {job['seconds']}s")
+
         def do_exit(self, args):
+            if any(job['running'] for job in update_queue.status()):
+                print('Waiting for the drivers being updated in the background...')
+                update_queue.stop()
             exit()
 
         def do_list(self, args):
             """
             List drivers
             """
-            driver_outputs = []
-            for driver in drivers:
-                # driver.print()
-                driver_outputs.append(driver.text(colorful=True))
+            cards = report_cache.get('list', (), lambda: [driver.card() for driver in drivers])
+            driver_outputs = [card_text(card, colorful=True) for card in cards]
 
             print_side_by_side(driver_outputs, line_len=65, dynamic_height=True, dynamic_at_a_time=True)
 
@@ -161,15 +379,15 @@ def main():
             if not self.selected_driver:
                 print('A driver must be selected')
                 return
+            if self.busy([self.selected_driver]):
+                return
 
-            
             check = input('Are you sure?  Type "YES" to confirm. ')
             if check != 'YES':
                 print(colored('    No confirmation.  Not deleting the driver', 'red'))
                 print('')
                 return
 
-            
             self.selected_driver.delete()
             drivers.remove(self.selected_driver)
             self.selected_driver = None
@@ -213,34 +431,80 @@ def main():
                         self.selected_driver = driver
                         break
 
+            self.selected_driver.ensure_loaded()
             self.prompt = colored(f' [*] {self.selected_driver.name} >> ', COLOR_PROMPT, attrs=['bold'])
             self.selected_driver.print()
                     
-        def do_add(self, id):
+        def do_add(self, ids):
             """
-            Add a new driver by ID
+            Add new drivers by ID: add 123 456, or add ids.txt for a file of IDs.
+            A trailing & adds them in the background.
             """
 
-            for driver in drivers:
-                if id == str(driver.id):
-                    driver.print()
-                    return
+            ids, in_background = background_args(ids)
+            driver_ids = parse_driver_ids(ids)
+            if not driver_ids:
+                print('Give one or more driver IDs, or a file of them')
+                return
+
+            tracked = {driver.id: driver for driver in drivers}
+            if len(driver_ids) == 1 and driver_ids[0] in tracked:
+                tracked[driver_ids[0]].print()
+                return
+
+            already = [tracked[driver_id].name for driver_id in driver_ids if driver_id in tracked]
+            if already:
+                print(f'  already tracking {", ".join(already)}')
+            driver_ids = [driver_id for driver_id in driver_ids if driver_id not in tracked]
+            if len(driver_ids) == 0:
+                return
+
+            # Already being added by a background job
+            driver_ids = [driver_id for driver_id in driver_ids if not update_queue.is_busy(driver_id)]
+            if len(driver_ids) == 0:
+                print('Those drivers are already being added')
+                return
+
+            if in_background:
+                job = update_queue.submit('add', dict.fromkeys(driver_ids), f'add {ids}')
+                print(f"  [{job['id']}] add {ids}: {job['total']} drivers in the background.  See \"jobs\".")
+                return
 
-            driver = Driver(id)
-            driver.gather_sessions()
-            drivers.append(driver)
+            for driver_id, driver, error in add_drivers(driver_ids):
+                if error:
+                    print(colored(f'    {driver_id}: {error}', COLOR_ERROR))
+                else:
+                    drivers.append(driver)
             drivers.sort(key=lambda x: x.elo, reverse=True)
+            report_cache.bump()
 
         def do_update(self, all):
+            """
+            update [all] [&]
+            A trailing & runs the update in the background
+            """
+
+            all, in_background = background_args(all)
             if all:
-                for driver in drivers:
-                    driver.gather_sessions()
+                selected = list(drivers)
+            elif self.selected_driver:
+                selected = [self.selected_driver]
+            else:
+                print('Select a driver with the "select" command, or pass the argument "all"')
+                return
+
+            if in_background:
+                self.submit_job('update', selected, f'update {all}'.strip())
+                return
+            if self.busy(selected):
+                return
+
+            if all:
+                for driver, error in update_drivers(drivers):
+                    print(colored(f'    {driver.name}: {error}', COLOR_ERROR))
 
             else:
-                if self.selected_driver:
-                    self.selected_driver.gather_sessions()
-                else:
-                    print('Select a driver with the "select" command, or pass the argument "all"')
+                self.selected_driver.gather_sessions()
 
             drivers.sort(key=lambda x: x.elo, reverse=True)
         
@@ -261,6 +525,8 @@ def main():
 
         def do_note(self, note):
             if self.selected_driver:
+                if self.busy([self.selected_driver]):
+                    return
                 self.selected_driver.update_notes(note)
             else:
                 print('No driver selected')
@@ -275,49 +541,26 @@ def main():
                 print('Please select a driver')
                 return
 
+            selected = self.selected_driver
             search_terms = args.strip()
-            search_terms = search_terms.split(' ')
-            shared = {}
-            for session in self.selected_driver.sessions:
-                session_id = session.session_id
-                split = session.split
-                if not session.dns and not session.dnf:
-                    for driver in drivers:
-                        if driver != self.selected_driver:
-                            for check_session in driver.sessions:
-                                include = True
-                                if check_session.session_id == session_id:
-                                    
-                                    data = {
-                                        'session': session_id,
-                                        'track': session.track,
-                                        'date': session.date,
-                                        'my position': session.finish_position,
-                                        'their position': check_session.finish_position,
-                                    }
-
-
-                                    if check_session.split == split and not check_session.dns and not check_session.dnf:
-                                        for term in search_terms:
-                                            if (term.lower() not in data['track'].lower()) and (term.lower() not in driver.name.lower()):
-                                                include = False
-
-                                        if include == True:
-                                            if driver.name not in shared:
-                                                shared[driver.name] = []
-                                            shared[driver.name].append(data)
+
+            def build():
+                load_all()
+                return shared_sessions(selected, search_terms.split(' '))
+
+            shared = report_cache.get('shared', (selected.id, search_terms), build)
 
             output = []
             for driver in shared:
                 msg = f'{colored(driver, COLOR_SUCCESS)}\n'
                 for session in shared[driver]:
                     if session['my position'] < session['their position']:
-                        session['my position'] = colored(f"P{session['my position']}", COLOR_GREEN)
-                        session['their position'] = f'P{session["their position"]}'
+                        my_position = colored(f"P{session['my position']}", COLOR_GREEN)
+                        their_position = f'P{session["their position"]}'
                     else:
-                        session['their position'] = colored(f"P{session['their position']}", COLOR_YELLOW)
-                        session['my position'] = f'P{session["my position"]}'
-                    msg = f'{msg}  {session["date"][0:10]} at {session["track"]} ({session["session"]}) {self.selected_driver.name} {session["my position"]} - {session["their position"]} {driver}\n'
+                        their_position = colored(f"P{session['their position']}", COLOR_YELLOW)
+                        my_position = f'P{session["my position"]}'
+                    msg = f'{msg}  {session["date"][0:10]} at {session["track"]} ({session["session"]}) {self.selected_driver.name} {my_position} - {their_position} {driver}\n'
                 msg = f'{msg} \n'
                 output.append(msg)
 
@@ -328,31 +571,12 @@ def main():
             Find chat messages based on user, message or session id
             """
 
+            load_all()
             output = []
-            ids = []
-
-            args = args.strip()
-            search_terms = args.split(' ')
-
-            for driver in drivers:
-                for session in driver.sessions:
-                    for chats in session.chat:
-                        for chat in chats:
-                            chat_id = chat['id']
-                            user_name = chat['name']
-                            message = chat['message']
-                            include = True
-                            for term in search_terms:
-                                if term.lower() not in user_name.lower():
-                                    if term.lower() not in message.lower():
-                                        if term not in str(session.session_id):
-                                            include = False
-                            if include == True:
-                                if chat_id not in ids:
-                                    ids.append(chat_id)
-                                    output.append(
-                                        f'Session {session.session_id}\n{colored(user_name, "blue")}: {message}\n'
-                                    )
+            for chat in chat_index.search(args.strip()):
+                output.append(
+                    f'Session {chat["session_id"]}\n{colored(chat["name"], "blue")}: {chat["message"]}\n'
+                )
 
             print_side_by_side(output, 5, 60)
 
@@ -401,8 +625,8 @@ def main():
                     temp_output = f"{colored(track_name, 'green')}\n"
                     track_data = self.selected_driver.tracks[track_name]
                     
-                    best_lap = '10:59.999'
-                    best_average = '10:59.999'
+                    best_lap = SLOWEST_TIME
+                    best_average = SLOWEST_TIME
 
                     include_track = False
 
@@ -414,13 +638,11 @@ def main():
                                 break
                             
                         if include:
-                            compared = compare_times(best_lap, track_data[car]['best'])
-                            if compared < 0:
-                                best_lap = track_data[car]['best']
+                            if track_data[car].best < best_lap:
+                                best_lap = track_data[car].best
 
-                            best_average_for_this_car = min_max(track_data[car]['average_laps'])['min']
-                            compared = compare_times(best_average, best_average_for_this_car)
-                            if compared < 0:
+                            best_average_for_this_car = track_data[car].best_average
+                            if best_average_for_this_car < best_average:
                                 best_average = best_average_for_this_car
 
                     for car in track_data:
@@ -432,15 +654,15 @@ def main():
 
                         if include:
                             include_track = True
-                            car_best = track_data[car]['best']
-                            best_average_for_this_car = min_max(track_data[car]['average_laps'])['min']
-                            car_races = track_data[car]['races']
+                            car_best = track_data[car].best
+                            best_average_for_this_car = track_data[car].best_average
+                            car_races = track_data[car].races
                             temp_output = f"{temp_output}   {colored(car, 'blue')}\n"
 
                             if car_best == best_lap:
-                                car_best = colored(car_best, 'magenta')
+                                car_best = colored(str(car_best), 'magenta')
                             if best_average_for_this_car == best_average:
-                                best_average_for_this_car = colored(best_average_for_this_car, 'magenta')
+                                best_average_for_this_car = colored(str(best_average_for_this_car), 'magenta')
 
                             temp_output = f"{temp_output}   Races: {car_races}, Best: {car_best}, Best Average: {best_average_for_this_car}\n\n"
 
@@ -449,57 +671,14 @@ def main():
 
             else:
 
-                zero_seconds = datetime.strptime('00:00.000', '%M:%S.%f')
-                data = {}
-                for driver in drivers:
-                    for track_name in driver.tracks:
-                        if track_name not in data:
-                            data[track_name] = {'Drivers': {}, 'Best': '10:59.999'}
-                        
-                        if driver.name not in data[track_name]['Drivers']:
-                            data[track_name]['Drivers'][driver.name] = {
-                                'avg': '',
-                                'seconds': 999
-                            }
-                        
-                        track_data = driver.tracks[track_name]
-                        best_average = '10:59.999'
-
-                        for car in track_data:
-                            if track_data[car]['average']:
-                                best_average_for_this_car = min_max(track_data[car]['average_laps'])['min']
-                                compared = compare_times(best_average, best_average_for_this_car)
-                                if compared < 0:
-                                    best_average = best_average_for_this_car
-                        
-                        
-                        data[track_name]['Drivers'][driver.name]['avg'] = best_average
-                        secs = datetime.strptime(best_average, '%M:%S.%f')
-                        diff = secs - zero_seconds
-                        data[track_name]['Drivers'][driver.name]['seconds'] = round(diff.total_seconds(), 3)
-
-                        compared = compare_times(data[track_name]['Best'], best_average)
-                        if compared < 0:
-                            data[track_name]['Best'] = best_average
-
-            
-
-                
-
-                for track_name in data:
-                    ordered = {}
-
-                    for k, v in sorted(data[track_name]['Drivers'].items(), key=lambda e: e[1]['seconds']):
-                        ordered[k] = v
-
-                    data[track_name]['Drivers'] = ordered
+                data = report_cache.get('tracks', (), lambda: best_averages_by_track(drivers))
 
                 for track_name in data:
                     temp = f'{colored(track_name, "green")}\n'
                     for driver in data[track_name]['Drivers']:
                         avg = data[track_name]['Drivers'][driver]['avg']
                         if avg == data[track_name]['Best']:
-                            avg = colored(avg, 'magenta')
+                            avg = colored(str(avg), 'magenta')
 
                         driver_print = colored(driver, 'blue')
                         if len(search_terms) > 0:
@@ -522,15 +701,34 @@ def main():
 
 
         def do_race(self, args):
+            """
+            race                            recent races
+            race <id>                       print a race
+            race <id> opponents             everyone in the split
+            race <id> compare <driver id>   lap by lap comparison
+            race <id> sectors               sector statistics vs the whole field (needs NumPy)
+            race <YYYY-MM-DD> [YYYY-MM-DD]  races on a day, or between two days
+            """
 
             if not self.selected_driver:
                 print('Please select a driver')
                 return
 
             args = args.strip()
-            if args == '':
-                print(colored('Recent races', COLOR_PROMPT))
-                for race in self.selected_driver.sessions[:10]:
+            if args == '' or '-' in args:
+                if args == '':
+                    print(colored('Recent races', COLOR_PROMPT))
+                    races = self.selected_driver.sessions[:10]
+                else:
+                    dates = args.split(' ')
+                    try:
+                        races = self.selected_driver.sessions_between_dates(dates[0], dates[-1])
+                    except ValueError:
+                        print('Dates should look like 2022-05-31')
+                        return
+                    print(colored(f'Races from {dates[0]} to {dates[-1]}', COLOR_PROMPT))
+
+                for race in races:
                     outcome = ''
                     if race.dns:
                         outcome = colored('DNS', 'red')
@@ -578,6 +776,11 @@ def main():
 
                             print_side_by_side(msgs, 4, 65)
 
+                    if second_arg == 'sectors':
+                        race = self.selected_driver.return_session(session_id)
+                        if race:
+                            race.print_sector_stats()
+
                     if second_arg == 'compare':
                         opponent_id = int(args[2])
                         race = self.selected_driver.return_session(session_id)
@@ -606,17 +809,23 @@ def main():
 
 
 
-            opponents = self.selected_driver.common(number_of_opponents, name_filter)
+            selected = self.selected_driver
+            opponents = report_cache.get(
+                'common',
+                (selected.id, number_of_opponents, name_filter),
+                lambda: selected.common(number_of_opponents, name_filter)
+            )
 
             output = []
             for driver in opponents:
                 id = driver['id']
+                name = driver['name']
                 if id_in_drivers(id, drivers):
-                    driver['name'] = colored(driver['name'], 'blue')
+                    name = colored(name, 'blue')
 
                 
                 output.append(
-                    f"{driver['count']} races with {driver['name']} ({driver['id']})"
+                    f"{driver['count']} races with {name} ({driver['id']})"
                 )
 
             
@@ -635,18 +844,16 @@ def main():
             printing = []
 
             bests = {
-                'lap': '10:59.999',
-                'average lap': '10:59.999',
+                'lap': SLOWEST_TIME,
+                'average lap': SLOWEST_TIME,
                 'finish position': 99
             }
             for race in races:
-                best_lap_comparison = compare_times(bests['lap'], race.best_lap)
-                if best_lap_comparison < 0:
+                if race.best_lap and race.best_lap < bests['lap']:
                     bests['lap'] = race.best_lap
 
 
-                avg_lap_comparison = compare_times(bests['average lap'], race.analysis["average"].time)
-                if avg_lap_comparison < 0:
+                if race.analysis["average"].time < bests['average lap']:
                     bests['average lap'] = race.analysis["average"].time
 
                 if race.finish_position < bests['finish position']:
@@ -680,16 +887,121 @@ def main():
 
 
         def do_force_update(self, all):
+            """
+            force_update [all] [&]
+            A trailing & runs the update in the background
+            """
+
+            all, in_background = background_args(all)
             if all == 'all':
-                for driver in drivers:
-                    driver.force_update()
+                selected = list(drivers)
+            elif self.selected_driver:
+                selected = [self.selected_driver]
+            else:
+                print('Select a driver with the "select" command, or pass the argument "all"')
+                return
+
+            if in_background:
+                self.submit_job('force_update', selected, f'force_update {all}'.strip())
+                return
+            if self.busy(selected):
+                return
+
+            if all == 'all':
+                for driver, error in update_drivers(drivers, force=True):
+                    print(colored(f'    {driver.name}: {error}', COLOR_ERROR))
 
             else:
-                if self.selected_driver:
-                    self.selected_driver.force_update()
-                else:
-                   print('Select a driver with the "select" command, or pass the argument "all"') 
+                self.selected_driver.force_update()
+
+
+        def do_rebuild(self, all):
+            """
+            Analyze every session again from the session cache and the
+            saved past-races listings, without going to the API.
+            rebuild all: every driver, one process per driver.
+            """
+
+            if all == 'all':
+                selected = list(drivers)
+            elif self.selected_driver:
+                selected = [self.selected_driver]
+            else:
+                print('Select a driver with the "select" command, or pass the argument "all"')
+                return
+            if self.busy(selected):
+                return
+
+            summaries = load_summaries()
+            failed = rebuild_drivers({driver.id: summaries.get(driver.id) for driver in selected})
+            for driver_id, error in failed:
+                print(colored(f'    {driver_id}: {error}', COLOR_ERROR))
+
+            # The old objects still hold the old sessions
+            summaries = load_summaries()
+            failed_ids = {driver_id for driver_id, _ in failed}
+            for driver in selected:
+                if driver.id in failed_ids:
+                    continue
+                if driver.loaded:
+                    shared_index.remove_driver(driver)
+                rebuilt = Driver(driver.id, summaries.get(driver.id))
+                drivers[drivers.index(driver)] = rebuilt
+                if self.selected_driver is driver:
+                    self.selected_driver = rebuilt
+
+            drivers.sort(key=lambda x: x.elo, reverse=True)
+            report_cache.bump()
+            print(f'  rebuilt {colored(len(selected) - len(failed), "blue")} drivers')
+
+        def do_convert(self, args):
+            """
+            Rewrite drivers still saved as pickles in the compact format
+            """
+
+            converted = convert_pickles(drivers)
+            print(f'  converted {colored(converted, "blue")} drivers')
+
+        def do_migrate_cache(self, args):
+            """
+            Copy the JSON session cache into the SQLite cache.
+            Set CACHE_BACKEND = 'sqlite' in classes/session_cache.py to use it.
+            """
+
+            copied = migrate_json_cache()
+            print(f'  copied {colored(copied, "blue")} sessions to {SESSION_CACHE_DB}')
+
+        def do_cache(self, args):
+            """
+            How the in-memory session cache is doing
+            """
+
+            stats = session_store.stats()
+            lookups = stats['hits'] + stats['misses']
+            hit_rate = round(100 * stats['hits'] / lookups, 1) if lookups else 0.0
+            print(f"  {stats['sessions']} sessions parsed, ~{round(stats['size'] / 1024 ** 2, 1)} of {round(stats['budget'] / 1024 ** 2)} MB")
+            print(f"  {stats['hits']} hits, {stats['misses']} misses ({hit_rate}% hit rate), {stats['evictions']} evicted")
+
+        def do_trim_cache(self, args):
+            """
+            Cut every cached session down to the fields the analysis reads
+            """
+
+            rewritten = reproject_cache(session_cache)
+            print(f'  trimmed {colored(rewritten, "blue")} sessions')
+
+        def do_compress_cache(self, args):
+            """
+            Gzip session cache files saved before compression, then
+            trim the cache back to its budget
+            """
+
+            if not isinstance(session_cache, JsonCache):
+                print('The session cache is not using the JSON backend')
+                return
 
+            compressed = session_cache.compress_all()
+            print(f'  compressed {colored(compressed, "blue")} sessions, cache is {round(session_cache.disk_usage() / 1024 ** 2, 1)} MB')
 
         def do_sandbag(self, args):
             